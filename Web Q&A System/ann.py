@@ -0,0 +1,106 @@
+import argparse
+import os
+import time
+import uuid
+import numpy as np
+from index_store import INDEX_DIR, float_vectors, load_index, read_manifest, update_manifest
+
+# Approximate nearest-neighbour search settings. Indexes smaller than ANN_MIN_ROWS are always
+# searched exactly. Rows are grouped into about sqrt(rows) inverted lists around k-means
+# centroids, and a query scans the N_PROBE lists whose centroids are closest to it: more lists
+# scanned means better recall and slower queries
+ANN_MIN_ROWS = 20000
+N_PROBE = 16
+KMEANS_ITERATIONS = 10
+TRAINING_ROWS_PER_LIST = 64
+
+# Rows assigned to lists at a time
+BLOCK_ROWS = 16384
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+def default_lists(n_rows):
+    return int(min(65536, max(16, np.sqrt(n_rows))))
+
+# Function to return the nearest centroid of every row of `unit_vectors`
+def nearest_centroids(unit_vectors, centroids):
+    return np.argmax(unit_vectors @ centroids.T, axis=1)
+
+# Function to train `n_lists` unit centroids with spherical k-means on a sample of the rows
+def train_centroids(index, n_lists, iterations=KMEANS_ITERATIONS, seed=0):
+    rng = np.random.default_rng(seed)
+    n_rows = len(index.vectors)
+    sample_rows = np.sort(rng.choice(n_rows, size=min(n_rows, n_lists * TRAINING_ROWS_PER_LIST), replace=False))
+    sample = normalize(float_vectors(index, sample_rows))
+    centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)]
+    for _ in range(iterations):
+        assignment = nearest_centroids(sample, centroids)
+        counts = np.bincount(assignment, minlength=n_lists)
+        sums = np.zeros_like(centroids)
+        order = np.argsort(assignment, kind="stable")
+        non_empty = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)])[non_empty]
+        sums[non_empty] = np.add.reduceat(sample[order], starts, axis=0)
+        # Lists that lost all their rows restart from a random row
+        empty = np.flatnonzero(counts == 0)
+        sums[empty] = sample[rng.choice(len(sample), size=len(empty), replace=False)]
+        centroids = normalize(sums)
+    return centroids.astype(np.float32)
+
+# Function to sort every row of the index into the list of its nearest centroid; returns the
+# row order and the offset where each list starts in it
+def assign_lists(index, centroids):
+    n_rows = len(index.vectors)
+    assignment = np.empty(n_rows, dtype=np.int64)
+    for start in range(0, n_rows, BLOCK_ROWS):
+        block = normalize(float_vectors(index, slice(start, start + BLOCK_ROWS)))
+        assignment[start:start + BLOCK_ROWS] = nearest_centroids(block, centroids)
+    order = np.argsort(assignment, kind="stable")
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=len(centroids)))])
+    return order, offsets
+
+# Function to build the inverted lists for the current index and attach them to its manifest.
+# Centroids from an earlier build are kept while the index stays within half to twice the size
+# they were trained on, so an update only costs one assignment pass; `retrain` forces k-means
+def build_ann(directory=INDEX_DIR, min_rows=ANN_MIN_ROWS, n_lists=None, retrain=False):
+    manifest = read_manifest(directory)
+    index = load_index(directory) if manifest is not None else None
+    if index is None:
+        return None
+    n_rows = len(index.vectors)
+    previous = manifest.get("ann") or {}
+    if n_rows < max(min_rows, 1):
+        if previous:
+            update_manifest(directory, ann=None)
+        return None
+
+    start = time.perf_counter()
+    trained_rows = previous.get("trained_rows", 0)
+    if (retrain or not previous.get("centroids") or not trained_rows / 2 <= n_rows <= trained_rows * 2
+            or (n_lists is not None and n_lists != previous.get("n_lists"))):
+        n_lists = n_lists or default_lists(n_rows)
+        centroids = train_centroids(index, n_lists)
+        ann = {"centroids": f"centroids-{uuid.uuid4().hex[:8]}.npy", "n_lists": n_lists, "trained_rows": n_rows}
+        np.save(os.path.join(directory, ann["centroids"]), centroids)
+    else:
+        centroids = np.load(os.path.join(directory, previous["centroids"]))
+        ann = dict(previous)
+
+    order, offsets = assign_lists(index, centroids)
+    ann["lists"] = f"lists-{uuid.uuid4().hex[:8]}.npz"
+    np.savez(os.path.join(directory, ann["lists"]), order=order, offsets=offsets)
+    version = update_manifest(directory, ann=ann)
+    print(f"Built {ann['n_lists']} inverted lists over {n_rows} rows in {time.perf_counter() - start:.1f}s.")
+    return version
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the approximate nearest-neighbour index.")
+    parser.add_argument("--lists", type=int, help="number of inverted lists (default: sqrt of the rows)")
+    parser.add_argument("--min-rows", type=int, default=ANN_MIN_ROWS, help="smaller indexes are searched exactly")
+    parser.add_argument("--retrain", action="store_true", help="retrain the centroids even if they still fit")
+    args = parser.parse_args()
+    if build_ann(min_rows=args.min_rows, n_lists=args.lists, retrain=args.retrain) is None:
+        print("No approximate index built; the index is missing or small enough to search exactly.")
@@ -0,0 +1,91 @@
+import threading
+import numpy as np
+
+# Default similarity above which a question reuses the answer to a cached one, and number of
+# answers kept. Paraphrases of a question usually score above 0.9 with text-embedding-3 models
+ANSWER_CACHE_THRESHOLD = 0.95
+ANSWER_CACHE_SIZE = 1024
+
+# Cache of answers looked up by question similarity rather than text. The embeddings of the
+# cached questions are rows of one unit-vector matrix, so a lookup is one matrix-vector product.
+# Answers are only reused for the same index version and the same `settings` (chat model, token
+# limits, ...): a new index version empties the cache. When full, the least recently used answer
+# is replaced. Safe to share between request threads
+class SemanticAnswerCache:
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, max_entries=ANSWER_CACHE_SIZE):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evicted = self.invalidated = 0
+        self._reset(None)
+
+    def _reset(self, version):
+        self.version = version
+        self.vectors = None
+        self.answers = [None] * self.max_entries
+        self.settings = np.full(self.max_entries, -1, dtype=np.int64)
+        self.setting_ids = {}
+        # Time of last use by a counter; -1 marks a free slot
+        self.last_used = np.full(self.max_entries, -1, dtype=np.int64)
+        self.clock = 0
+
+    # Function to drop every cached answer, e.g. after a re-crawl
+    def invalidate(self):
+        with self.lock:
+            self.invalidated += int((self.last_used >= 0).sum())
+            self._reset(None)
+
+    # Function to return the cached answer to the question closest to `embedding`, or None when
+    # no cached question of this index version and settings is similar enough
+    def get(self, version, settings, embedding):
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1)
+        with self.lock:
+            setting_id = self.setting_ids.get(settings)
+            if version != self.version or setting_id is None or self.vectors is None:
+                self.misses += 1
+                return None
+            similarities = np.where(self.settings == setting_id, self.vectors @ query, -np.inf)
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+            self.clock += 1
+            self.last_used[best] = self.clock
+            self.hits += 1
+            return self.answers[best]
+
+    def put(self, version, settings, embedding, answer):
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) or 1)
+        with self.lock:
+            if version != self.version:
+                self.invalidated += int((self.last_used >= 0).sum())
+                self._reset(version)
+            if self.vectors is None:
+                self.vectors = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+            slot = int(np.argmin(self.last_used))
+            if self.last_used[slot] >= 0:
+                self.evicted += 1
+            self.clock += 1
+            self.vectors[slot] = vector
+            self.answers[slot] = answer
+            self.settings[slot] = self.setting_ids.setdefault(settings, len(self.setting_ids))
+            self.last_used[slot] = self.clock
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "entries": int((self.last_used >= 0).sum()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evicted": self.evicted,
+                "invalidated": self.invalidated,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def summary(self):
+        stats = self.stats()
+        return (f"Answer cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate'] * 100:.1f}% hit rate), "
+                f"{stats['evicted']} evicted, {stats['invalidated']} invalidated")
@@ -1,18 +1,24 @@
-from flask import Flask, render_template, request, redirect, url_for
+from flask import Flask, Response, jsonify, render_template, request, redirect, stream_with_context, url_for
+import json
 import os
-import pandas as pd
 import tiktoken
-import numpy as np
 from openai import OpenAI
-from ast import literal_eval
-from typing import List
-from scipy import spatial
 from embedding import generate_embeddings
 from crawler import crawl_website
+from ann import N_PROBE
+from answer_cache import SemanticAnswerCache
+from query_cache import open_query_cache
+from retrieval import IndexHolder, SearchIndex
 
 # Initialize OpenAI client
 client = OpenAI(api_key=os.getenv("API_KEY"))
 
+# Embeddings of recent questions, kept in memory and on disk
+query_cache = open_query_cache()
+
+# Answers to recent questions, reused for paraphrases while the index is unchanged
+answer_cache = SemanticAnswerCache()
+
 # Initialize Flask app
 app = Flask(__name__)
 
@@ -20,47 +26,53 @@ app = Flask(__name__)
 tokenizer = tiktoken.get_encoding("cl100k_base")
 
 # Utility functions for embedding and question-answer logic
-def distances_from_embeddings(query_embedding: List[float], embeddings: List[List[float]], distance_metric="cosine") -> List[float]:
-    distance_metrics = {
-        "cosine": spatial.distance.cosine,
-        "L1": spatial.distance.cityblock,
-        "L2": spatial.distance.euclidean,
-        "Linf": spatial.distance.chebyshev,
-    }
-    return [distance_metrics[distance_metric](query_embedding, embedding) for embedding in embeddings]
-
-def create_context(question: str, df: pd.DataFrame, max_len: int = 1800, model: str = "text-embedding-3-small", distance_metric: str = "cosine"):
-    q_embeddings = client.embeddings.create(input=question, model=model).data[0].embedding
-    df['distances'] = distances_from_embeddings(q_embeddings, df['embeddings'].tolist(), distance_metric)
-
-    returns, cur_len = [], 0
-    for _, row in df.sort_values('distances', ascending=True).iterrows():
-        cur_len += row['n_tokens'] + 4
-        if cur_len > max_len:
-            break
-        returns.append(row["text"])
-    
-    return "\n\n###\n\n".join(returns)
+# Function to embed a question with the API; repeated questions are served by `query_cache`
+def embed_query(question, model, dimensions):
+    options = {"dimensions": dimensions} if dimensions else {}
+    return client.embeddings.create(input=question, model=model, **options).data[0].embedding
+
+# The question is embedded with the model and dimensions the index was built with. Large
+# indexes are searched approximately; `n_probe` trades recall for latency
+def create_context(question: str, index: SearchIndex, max_len: int = 1800, model: str = "text-embedding-3-small", distance_metric: str = "cosine", n_probe: int = N_PROBE, q_embeddings=None):
+    if q_embeddings is None:
+        q_embeddings = query_cache.embedding(question, index.model or model, index.dimensions, embed_query)
+    return "\n\n###\n\n".join(index.context(q_embeddings, max_len, distance_metric, n_probe))
+
+# The index is loaded once per process and shared by all requests; a new version written by
+# the embedding generator is picked up without restarting the app
+index_holder = IndexHolder()
 
 def prepare_data():
-    if not os.path.exists('processed/embeddings.csv'):
-        return None
-    df = pd.read_csv('processed/embeddings.csv', index_col=0)
-    df['embeddings'] = df['embeddings'].apply(literal_eval).apply(np.array)
-    return df
-
-def answer_question(df, question, model="gpt-4o-mini", max_len=1800, max_tokens=150):
-    # Create the context from the dataframe
-    context = create_context(question, df, max_len)
+    return index_holder.get()
+
+# Function to build the chat messages asking to answer `question` from `context`
+def answer_messages(context, question):
+    return [
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": f"Answer the question based on the context below, and if the question can't be answered based on the context, say 'I don't know'.\n\nContext: {context}\n\nQuestion: {question}\nAnswer:"}
+    ]
+
+def clean_answer(answer):
+    if not answer or answer.lower() in ["", "i don't know", "i don’t know"]:
+        return "I don't know"
+    return answer
+
+def answer_question(index, question, model="gpt-4o-mini", max_len=1800, max_tokens=150):
+    # Reuse the answer to an earlier question that means the same, if there is one
+    q_embeddings = query_cache.embedding(question, index.model or "text-embedding-3-small", index.dimensions, embed_query)
+    settings = (model, max_len, max_tokens)
+    cached = answer_cache.get(index.version, settings, q_embeddings)
+    if cached is not None:
+        return cached
+
+    # Create the context from the index
+    context = create_context(question, index, max_len, q_embeddings=q_embeddings)
     
     try:
         # Create the chat completion request
         response = client.chat.completions.create(
             model=model,
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": f"Answer the question based on the context below, and if the question can't be answered based on the context, say 'I don't know'.\n\nContext: {context}\n\nQuestion: {question}\nAnswer:"}
-            ],
+            messages=answer_messages(context, question),
             temperature=0,
             max_tokens=max_tokens
         )
@@ -69,14 +81,71 @@ def answer_question(df, question, model="gpt-4o-mini", max_len=1800, max_tokens=
         answer = response.choices[0].message.content.strip()
 
         # If the answer is blank or non-informative, return "I don't know"
-        if not answer or answer.lower() in ["", "i don't know", "i don’t know"]:
-            return "I don't know"
-        
+        answer = clean_answer(answer)
+        answer_cache.put(index.version, settings, q_embeddings, answer)
         return answer
 
     except Exception as e:
         return f"Error: {e}"
 
+# Function to answer a question as a stream of (event, text) pairs: a "token" for every piece
+# of the answer as the chat model produces it, then the final "answer" (cleaned up like the
+# answers of answer_question), or an "error"
+def stream_answer(index, question, model="gpt-4o-mini", max_len=1800, max_tokens=150):
+    if not question.strip():
+        yield "error", "Please ask a question."
+        return
+
+    settings = (model, max_len, max_tokens)
+    pieces = []
+    try:
+        q_embeddings = query_cache.embedding(question, index.model or "text-embedding-3-small", index.dimensions, embed_query)
+        cached = answer_cache.get(index.version, settings, q_embeddings)
+        if cached is not None:
+            yield "answer", cached
+            return
+
+        context = create_context(question, index, max_len, q_embeddings=q_embeddings)
+        stream = client.chat.completions.create(
+            model=model,
+            messages=answer_messages(context, question),
+            temperature=0,
+            max_tokens=max_tokens,
+            stream=True
+        )
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                pieces.append(chunk.choices[0].delta.content)
+                yield "token", pieces[-1]
+    except Exception as e:
+        yield "error", f"Error: {e}"
+        return
+
+    answer = clean_answer("".join(pieces).strip())
+    answer_cache.put(index.version, settings, q_embeddings, answer)
+    yield "answer", answer
+
+# Function to format one server-sent event; the data is JSON so newlines survive
+def server_sent_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# Route to stream the answer to a question over server-sent events, so the first words show up
+# as soon as the chat model produces them. The page falls back to the form post without it
+@app.route("/stream")
+def stream():
+    question = request.args.get("question", "")
+
+    def events():
+        index = prepare_data()
+        if index is None:
+            yield server_sent_event("error", "No embeddings found. Please run the crawler and embedding generator.")
+            return
+        for event, data in stream_answer(index, question):
+            yield server_sent_event(event, data)
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # Route to handle the home page and form submission
 @app.route("/", methods=["GET", "POST"])
 def index():
@@ -88,12 +157,12 @@ def index():
         question = request.form.get("question")
 
         # Check if the embeddings file is available
-        df = prepare_data()
-        if df is None:
+        index = prepare_data()
+        if index is None:
             return render_template("index.html", question=question, answer="No embeddings found. Please run the crawler and embedding generator.")
 
         # Generate the answer to the question
-        answer = answer_question(df, question)
+        answer = answer_question(index, question)
     
     return render_template("index.html", question=question, answer=answer)
 
@@ -107,10 +176,21 @@ def crawl_and_generate():
     # Crawl the website
     crawl_website(full_url, limit)
 
-    # Generate embeddings
-    generate_embeddings()
+    # Generate embeddings, in this process rather than in workers started from the server
+    generate_embeddings(processes=1)
+
+    # Swap in the new index right away
+    index_holder.reload()
+
+    # Answers were given from the old pages
+    answer_cache.invalidate()
 
     return redirect(url_for("index"))
 
+# Route to report the hit rates of the query embedding and answer caches
+@app.route("/cache_stats")
+def cache_stats():
+    return jsonify(query_cache=query_cache.stats(), answer_cache=answer_cache.stats())
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,191 @@
+import argparse
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web
+from openai import AsyncOpenAI
+from embedding import generate_embeddings
+from crawler import crawl_website
+from ann import N_PROBE
+from app import (answer_cache, answer_messages, app as flask_app, clean_answer, index_holder, query_cache,
+                 server_sent_event)
+
+# Asynchronous serving mode of the Q&A app: the same pages, caches and index as app.py, served
+# by aiohttp on one event loop. Embedding and chat requests are awaited on one shared
+# AsyncOpenAI client (one connection pool), so a single process keeps hundreds of questions in
+# flight instead of tying up a worker thread per question. It is not faster than app.py under
+# app.run, which also starts a thread per request: both spend about 10ms of CPU per question,
+# mostly in the OpenAI client, and that is what limits them. It is faster than a fixed pool of
+# worker threads, and needs one thread where app.run needs one per open request.
+# Run with python async_app.py
+
+# Initialize the async OpenAI client
+client = AsyncOpenAI(api_key=os.getenv("API_KEY"))
+
+# OpenAI requests in flight at once; later ones wait for a free slot
+MAX_IN_FLIGHT = 256
+
+# Default address of the server
+HOST = "127.0.0.1"
+PORT = 5000
+
+# Threads for the disk tier of the query cache, which serializes its SQLite access anyway
+QUERY_CACHE_THREADS = 2
+
+# Indexes up to this many rows are searched on the event loop (about 1.5ms at 1536
+# dimensions); larger ones in a worker thread
+INLINE_SEARCH_ROWS = 2000
+
+in_flight = asyncio.Semaphore(MAX_IN_FLIGHT)
+query_cache_executor = ThreadPoolExecutor(QUERY_CACHE_THREADS, thread_name_prefix="query-cache")
+
+async def embed_query(question, model, dimensions):
+    options = {"dimensions": dimensions} if dimensions else {}
+    async with in_flight:
+        response = await client.embeddings.create(input=question, model=model, **options)
+    return response.data[0].embedding
+
+# Function to return the embedding of a question, from the query cache when it has it. Memory
+# hits are served on the event loop; only the disk tier runs in the cache's own threads, and a
+# new embedding is written to disk without waiting for it
+async def question_embedding(question, index, model="text-embedding-3-small"):
+    model, dimensions = index.model or model, index.dimensions
+    vector = query_cache.get_memory(question, model, dimensions)
+    if vector is not None:
+        return vector
+    loop = asyncio.get_running_loop()
+    vector = await loop.run_in_executor(query_cache_executor, query_cache.get_persistent, question, model, dimensions)
+    if vector is None:
+        vector = query_cache.remember(question, model, dimensions, await embed_query(question, model, dimensions))
+        loop.run_in_executor(query_cache_executor, query_cache.persist, question, model, dimensions, vector)
+    return vector
+
+# Large indexes are searched in a worker thread so they do not stall the event loop
+async def create_context(question, index, max_len=1800, model="text-embedding-3-small", distance_metric="cosine",
+                         n_probe=N_PROBE, q_embeddings=None):
+    if q_embeddings is None:
+        q_embeddings = await question_embedding(question, index, model)
+    if len(index) <= INLINE_SEARCH_ROWS:
+        sections = index.context(q_embeddings, max_len, distance_metric, n_probe)
+    else:
+        sections = await asyncio.to_thread(index.context, q_embeddings, max_len, distance_metric, n_probe)
+    return "\n\n###\n\n".join(sections)
+
+# The index is only loaded or re-checked in a worker thread when that is due
+async def prepare_data():
+    index = index_holder.current()
+    return index if index is not None else await asyncio.to_thread(index_holder.get)
+
+async def answer_question(index, question, model="gpt-4o-mini", max_len=1800, max_tokens=150):
+    # Reuse the answer to an earlier question that means the same, if there is one
+    q_embeddings = await question_embedding(question, index)
+    settings = (model, max_len, max_tokens)
+    cached = answer_cache.get(index.version, settings, q_embeddings)
+    if cached is not None:
+        return cached
+
+    context = await create_context(question, index, max_len, q_embeddings=q_embeddings)
+    try:
+        async with in_flight:
+            response = await client.chat.completions.create(
+                model=model,
+                messages=answer_messages(context, question),
+                temperature=0,
+                max_tokens=max_tokens
+            )
+        answer = clean_answer(response.choices[0].message.content.strip())
+        answer_cache.put(index.version, settings, q_embeddings, answer)
+        return answer
+    except Exception as e:
+        return f"Error: {e}"
+
+# Async counterpart of app.stream_answer
+async def stream_answer(index, question, model="gpt-4o-mini", max_len=1800, max_tokens=150):
+    if not question.strip():
+        yield "error", "Please ask a question."
+        return
+
+    settings = (model, max_len, max_tokens)
+    pieces = []
+    try:
+        q_embeddings = await question_embedding(question, index)
+        cached = answer_cache.get(index.version, settings, q_embeddings)
+        if cached is not None:
+            yield "answer", cached
+            return
+
+        context = await create_context(question, index, max_len, q_embeddings=q_embeddings)
+        async with in_flight:
+            stream = await client.chat.completions.create(
+                model=model,
+                messages=answer_messages(context, question),
+                temperature=0,
+                max_tokens=max_tokens,
+                stream=True
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    pieces.append(chunk.choices[0].delta.content)
+                    yield "token", pieces[-1]
+    except Exception as e:
+        yield "error", f"Error: {e}"
+        return
+
+    answer = clean_answer("".join(pieces).strip())
+    answer_cache.put(index.version, settings, q_embeddings, answer)
+    yield "answer", answer
+
+def render(question=None, answer=None):
+    html = flask_app.jinja_env.get_template("index.html").render(question=question, answer=answer)
+    return web.Response(text=html, content_type="text/html")
+
+async def index(request):
+    if request.method != "POST":
+        return render()
+    question = (await request.post()).get("question")
+    index = await prepare_data()
+    if index is None:
+        return render(question, "No embeddings found. Please run the crawler and embedding generator.")
+    return render(question, await answer_question(index, question))
+
+async def stream(request):
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache",
+                                           "X-Accel-Buffering": "no"})
+    await response.prepare(request)
+    index = await prepare_data()
+    if index is None:
+        await response.write(server_sent_event("error", "No embeddings found. Please run the crawler and embedding generator.").encode())
+    else:
+        async for event, data in stream_answer(index, request.query.get("question", "")):
+            await response.write(server_sent_event(event, data).encode())
+    await response.write_eof()
+    return response
+
+# Crawling and embedding are blocking, so they run in a worker thread (embedding in this
+# process rather than in workers started from the server)
+async def crawl_and_generate(request):
+    form = await request.post()
+    await asyncio.to_thread(crawl_website, form.get("url"), int(form.get("limit", 10)))
+    await asyncio.to_thread(generate_embeddings, processes=1)
+    await asyncio.to_thread(index_holder.reload)
+    answer_cache.invalidate()
+    raise web.HTTPFound("/")
+
+async def cache_stats(request):
+    return web.json_response({"query_cache": query_cache.stats(), "answer_cache": answer_cache.stats()})
+
+def make_app():
+    aio_app = web.Application()
+    aio_app.router.add_route("GET", "/", index)
+    aio_app.router.add_route("POST", "/", index)
+    aio_app.router.add_get("/stream", stream)
+    aio_app.router.add_post("/crawl_and_generate", crawl_and_generate)
+    aio_app.router.add_get("/cache_stats", cache_stats)
+    return aio_app
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the Q&A app asynchronously.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args()
+    web.run_app(make_app(), host=args.host, port=args.port)
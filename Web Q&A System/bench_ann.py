@@ -0,0 +1,63 @@
+import argparse
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from ann import build_ann, N_PROBE
+from bench_quantization import synthetic_vectors
+from index_store import load_index, save_index
+from retrieval import SearchIndex
+
+# Benchmark: exact search against the inverted-list index on synthetic clustered vectors,
+# reporting query latency and recall@k of the approximate search for several n_probe values
+
+def top_k(rows, distances, k):
+    best = np.argpartition(distances, k)[:k] if len(distances) > k else np.arange(len(distances))
+    return rows[best]
+
+def timed_search(index, queries, n_probe, k):
+    start = time.perf_counter()
+    results = [top_k(*index.search(query, "cosine", n_probe), k) for query in queries]
+    return (time.perf_counter() - start) / len(queries), results
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare exact and approximate nearest-neighbour search.")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--dims", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--spread", type=float, default=3.0,
+                        help="noise around the cluster centres; higher makes the lists harder to separate "
+                             "(3.0 suits 1536 dimensions, about 2.5 suits 384)")
+    parser.add_argument("--n-probe", type=int, nargs="+", default=[1, 4, 8, N_PROBE, 32, 64])
+    args = parser.parse_args()
+
+    # Queries are held-out draws from the same clusters, not perturbed rows of the index, and the
+    # clusters overlap: with well separated clusters or a query next to a stored row, every
+    # neighbour sits in the nearest list and recall is 1.0 whatever n_probe is
+    vectors = synthetic_vectors(args.rows + args.queries, args.dims, spread=args.spread)
+    vectors, queries = vectors[:args.rows], vectors[args.rows:]
+    meta = pd.DataFrame({"filename": "", "text": [""] * args.rows, "n_tokens": 0})
+    with tempfile.TemporaryDirectory() as directory:
+        save_index(meta, vectors, directory=directory)
+        del vectors
+        exact = SearchIndex(load_index(directory))
+        start = time.perf_counter()
+        build_ann(directory, min_rows=0)
+        build_time = time.perf_counter() - start
+        approximate = SearchIndex(load_index(directory))
+
+    n_lists = len(approximate.ann.centroids)
+    print(f"{args.rows} rows x {args.dims} dimensions; {n_lists} lists built in {build_time:.1f}s")
+    exact_time, expected = timed_search(exact, queries, N_PROBE, args.k)
+    print(f"{'search':<18} {'latency':>9} {'speedup':>8} {f'recall@{args.k}':>10}")
+    print(f"{'exact':<18} {exact_time * 1000:>7.2f}ms {1:>7.1f}x {1:>10.3f}")
+    for n_probe in args.n_probe:
+        if n_probe >= n_lists:
+            continue
+        latency, found = timed_search(approximate, queries, n_probe, args.k)
+        recall = np.mean([len(set(f) & set(e)) / args.k for f, e in zip(found, expected)])
+        print(f"{f'ann n_probe={n_probe}':<18} {latency * 1000:>7.2f}ms {exact_time / latency:>7.1f}x {recall:>10.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import argparse
+import random
+import time
+from chunking import MAX_TOKENS, chunk_documents, tokenizer
+
+# Benchmark: chunk a synthetic text corpus (100 MB by default) with the original pipeline,
+# which encodes every page, every sentence and every chunk separately, and with the
+# single-pass pipeline that encodes each page once in multithreaded batches
+
+WORDS = ("the crawler fetches every page of the website and the embedding model turns each chunk "
+         "into a vector so questions can be answered from the closest context sections").split()
+
+def make_corpus(total_bytes, page_bytes, seed=0):
+    rng = random.Random(seed)
+    pages, size = [], 0
+    while size < total_bytes:
+        sentences, length = [], 0
+        while length < page_bytes:
+            sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 40))).capitalize()
+            sentences.append(sentence)
+            length += len(sentence) + 2
+        page = ". ".join(sentences) + "."
+        pages.append((f"page-{len(pages)}", page))
+        size += len(page)
+    return pages
+
+# The original embedding.py chunking, kept here as the baseline
+def legacy_split_into_many(text, max_tokens=MAX_TOKENS):
+    sentences = text.split('. ')
+    n_tokens = [len(tokenizer.encode(" " + sentence)) for sentence in sentences]
+
+    chunks, chunk = [], []
+    tokens_so_far = 0
+
+    for sentence, token in zip(sentences, n_tokens):
+        if tokens_so_far + token > max_tokens:
+            chunks.append(". ".join(chunk) + ".")
+            chunk = []
+            tokens_so_far = 0
+        if token > max_tokens:
+            continue
+        chunk.append(sentence)
+        tokens_so_far += token + 1
+
+    if chunk:
+        chunks.append(". ".join(chunk) + ".")
+    return chunks
+
+def legacy_chunks(pages):
+    shortened = []
+    for _, text in pages:
+        if len(tokenizer.encode(text)) > MAX_TOKENS:
+            shortened += legacy_split_into_many(text)
+        else:
+            shortened.append(text)
+    return [(chunk, len(tokenizer.encode(chunk))) for chunk in shortened]
+
+def single_pass_chunks(pages):
+    return [(chunk, n_tokens) for _, chunk, n_tokens in chunk_documents(pages)]
+
+def run(label, chunker, pages, corpus_mb):
+    start = time.perf_counter()
+    chunks = chunker(pages)
+    elapsed = time.perf_counter() - start
+    n_tokens = sum(n for _, n in chunks)
+    print(f"{label:<12} {elapsed:8.2f}s  {corpus_mb / elapsed:7.2f} MB/s  {len(chunks):8d} chunks  {n_tokens:11d} tokens")
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the original and the single-pass chunking pipelines.")
+    parser.add_argument("--mb", type=float, default=100, help="corpus size in MB")
+    parser.add_argument("--page-kb", type=float, default=20, help="average page size in KB")
+    args = parser.parse_args()
+
+    pages = make_corpus(int(args.mb * 1e6), int(args.page_kb * 1e3))
+    corpus_mb = sum(len(text) for _, text in pages) / 1e6
+    print(f"Corpus: {len(pages)} pages, {corpus_mb:.1f} MB")
+    chunk_documents([("warm-up", "Warm up the tokenizer.")])
+
+    legacy = run("original", legacy_chunks, pages, corpus_mb)
+    single = run("single-pass", single_pass_chunks, pages, corpus_mb)
+    print(f"Speedup: {legacy / single:.2f}x")
+
+if __name__ == "__main__":
+    main()
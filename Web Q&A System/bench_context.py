@@ -0,0 +1,52 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from bench_quantization import make_queries, synthetic_vectors
+from index_store import StoredIndex
+from retrieval import SearchIndex
+
+# Benchmark: building the context for a query by sorting the whole frame and walking it with
+# iterrows, against partial top-k selection and packing from the n_tokens array
+
+def legacy_context(index, query, max_len):
+    df = index.meta.copy()
+    df['distances'] = index.distances(query)
+    returns, cur_len = [], 0
+    for _, row in df.sort_values('distances', ascending=True).iterrows():
+        cur_len += row['n_tokens'] + 4
+        if cur_len > max_len:
+            break
+        returns.append(row["text"])
+    return returns
+
+def timed(function, index, queries, max_len):
+    start = time.perf_counter()
+    results = [function(index, query, max_len) for query in queries]
+    return (time.perf_counter() - start) / len(queries), results
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare full-sort and top-k context building.")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dims", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--max-len", type=int, default=1800)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = synthetic_vectors(args.rows, args.dims)
+    queries = make_queries(vectors, args.queries, noise=0.5)
+    meta = pd.DataFrame({"filename": "", "text": [f"chunk {i}" for i in range(args.rows)],
+                         "n_tokens": rng.integers(20, 500, size=args.rows)})
+    index = SearchIndex(StoredIndex(meta, vectors, "bench"))
+
+    legacy_time, expected = timed(legacy_context, index, queries, args.max_len)
+    top_k_time, found = timed(lambda index, query, max_len: index.context(query, max_len), index, queries, args.max_len)
+    if found != expected:
+        print("Contexts differ")
+    print(f"{args.rows} rows x {args.dims} dimensions, max_len {args.max_len}")
+    print(f"sort + iterrows {legacy_time * 1000:8.2f}ms")
+    print(f"top-k packing   {top_k_time * 1000:8.2f}ms  {legacy_time / top_k_time:6.1f}x")
+
+if __name__ == "__main__":
+    main()
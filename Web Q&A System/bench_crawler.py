@@ -0,0 +1,69 @@
+import argparse
+import contextlib
+import io
+import os
+import resource
+import sys
+import tempfile
+import time
+from bench_site import site_stats, start_site
+from crawler import MAX_CONCURRENCY, MAX_PER_HOST, crawl_website
+from shards import iter_records
+
+# Benchmark: crawl the local synthetic site and report pages/sec, bytes/sec, duplicate
+# fetches and peak memory. The thresholds make it usable as an offline regression check in CI
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark crawl_website against a local synthetic site.")
+    parser.add_argument("--pages", type=int, default=500, help="pages on the synthetic site")
+    parser.add_argument("--limit", type=int, default=None, help="pages to crawl (default: all)")
+    parser.add_argument("--fan-out", type=int, default=10)
+    parser.add_argument("--size", type=int, default=5000, help="approximate main content size in bytes")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENCY)
+    parser.add_argument("--per-host", type=int, default=MAX_PER_HOST)
+    parser.add_argument("--verbose", action="store_true", help="show the crawler's own output")
+    parser.add_argument("--min-pages-per-sec", type=float, default=None, help="fail below this throughput")
+    parser.add_argument("--max-duplicate-fetches", type=int, default=None, help="fail above this many duplicate fetches")
+    args = parser.parse_args()
+
+    process, base_url = start_site(args.pages, args.fan_out, args.size, args.latency, args.error_rate)
+    limit = args.limit or args.pages
+    cwd = os.getcwd()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            os.chdir(workdir)
+            try:
+                output = sys.stdout if args.verbose else io.StringIO()
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(output):
+                    crawl_website(f"{base_url}/page/0", limit, args.concurrency, args.per_host, incremental=False)
+                elapsed = time.perf_counter() - start
+                pages = sum(1 for _ in iter_records())
+            finally:
+                os.chdir(cwd)
+        stats = site_stats(base_url)
+    finally:
+        process.terminate()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    pages_per_sec = pages / elapsed
+    print(f"Pages crawled:     {pages} in {elapsed:.2f}s")
+    print(f"Throughput:        {pages_per_sec:.1f} pages/s, {stats['bytes'] / elapsed / 1024:.1f} KiB/s")
+    print(f"Requests:          {stats['requests']} (status counts {stats['status']})")
+    print(f"Duplicate fetches: {stats['duplicates']}")
+    print(f"Peak RSS:          {rss_after / 1024:.1f} MiB (+{(rss_after - rss_before) / 1024:.1f} MiB during the crawl)")
+
+    failed = False
+    if args.min_pages_per_sec is not None and pages_per_sec < args.min_pages_per_sec:
+        print(f"FAIL: throughput below {args.min_pages_per_sec} pages/s")
+        failed = True
+    if args.max_duplicate_fetches is not None and stats["duplicates"] > args.max_duplicate_fetches:
+        print(f"FAIL: more than {args.max_duplicate_fetches} duplicate fetches")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from scipy import spatial
+from index_store import StoredIndex, quantize_int8
+from retrieval import DISTANCE_METRICS, SearchIndex, distances_from_embeddings
+
+# Micro-benchmark: distance from one query to every chunk, with the original per-row scipy
+# loop, the vectorized function and the pre-normalized SearchIndex (float32 and int8)
+
+SCIPY_METRICS = {
+    "cosine": spatial.distance.cosine,
+    "L1": spatial.distance.cityblock,
+    "L2": spatial.distance.euclidean,
+    "Linf": spatial.distance.chebyshev,
+}
+
+def scipy_loop(query, embeddings, metric):
+    return [SCIPY_METRICS[metric](query, embedding) for embedding in embeddings]
+
+def best_of(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), np.asarray(result, dtype=np.float64)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-row and vectorized distance computation.")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dims", type=int, default=1536)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((args.rows, args.dims), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    query = rng.standard_normal(args.dims, dtype=np.float32)
+    query /= np.linalg.norm(query)
+    meta = pd.DataFrame({"text": [""] * args.rows, "n_tokens": 0})
+    embeddings = list(vectors)
+
+    start = time.perf_counter()
+    index = SearchIndex(StoredIndex(meta, vectors, "bench"))
+    codes, scales = quantize_int8(vectors)
+    int8_index = SearchIndex(StoredIndex(meta, codes, "bench", scales))
+    print(f"{args.rows} rows x {args.dims} dimensions; SearchIndex built in {time.perf_counter() - start:.2f}s")
+
+    print(f"{'metric':<7} {'scipy loop':>11} {'vectorized':>11} {'SearchIndex':>12} {'int8':>9} {'speedup':>8}")
+    for metric in DISTANCE_METRICS:
+        loop, expected = best_of(lambda: scipy_loop(query, embeddings, metric), 1)
+        vectorized, result = best_of(lambda: distances_from_embeddings(query, vectors, metric), args.repeat)
+        searched, indexed = best_of(lambda: index.distances(query, metric), args.repeat)
+        quantized, _ = best_of(lambda: int8_index.distances(query, metric), args.repeat)
+        if not (np.allclose(result, expected, atol=1e-4) and np.allclose(indexed, expected, atol=1e-4)):
+            print(f"{metric}: results differ from scipy")
+        print(f"{metric:<7} {loop * 1000:>9.1f}ms {vectorized * 1000:>9.1f}ms {searched * 1000:>10.1f}ms "
+              f"{quantized * 1000:>7.1f}ms {loop / searched:>7.0f}x")
+
+if __name__ == "__main__":
+    main()
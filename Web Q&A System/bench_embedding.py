@@ -0,0 +1,68 @@
+import argparse
+import random
+import time
+import numpy as np
+import tiktoken
+from openai import OpenAI
+from embed_scheduler import EmbeddingScheduler, pack_batches
+from fake_openai import fake_embedding, fake_stats, start_fake_openai
+
+# Benchmark: embed synthetic chunks through the concurrent scheduler against the fake local
+# endpoint, serially and concurrently, and check every vector landed on the right row
+
+WORDS = "crawler embedding context question answer website page token vector model search index".split()
+
+def make_chunks(n_chunks, chunk_words, seed=0):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(chunk_words)) + f" #{i}" for i in range(n_chunks)]
+
+def run(label, client, texts, n_tokens, batch_inputs, requests_per_minute, tokens_per_minute, workers):
+    scheduler = EmbeddingScheduler(client, "text-embedding-3-small", requests_per_minute, tokens_per_minute,
+                                   workers, progress_interval=float("inf"))
+    batches = list(pack_batches(n_tokens, max_inputs=batch_inputs))
+    requests = (([texts[i] for i in batch], sum(n_tokens[i] for i in batch)) for batch in batches)
+    start = time.perf_counter()
+    results = list(scheduler.map(requests))
+    elapsed = time.perf_counter() - start
+
+    correct = all(
+        np.allclose(embedding, fake_embedding(texts[i]), atol=1e-6)
+        for batch, embeddings in zip(batches, results)
+        for i, embedding in zip(batch, embeddings)
+    )
+    print(f"{label:<28} {elapsed:7.2f}s  {len(batches) / elapsed * 60:8.0f} requests/min  "
+          f"{sum(n_tokens) / elapsed * 60:10.0f} tokens/min  {scheduler.n_rate_limited:4d} rate-limited  "
+          f"{'rows OK' if correct else 'ROWS MISMATCHED'}")
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the embedding scheduler against a fake local endpoint.")
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--chunk-words", type=int, default=150)
+    parser.add_argument("--batch-inputs", type=int, default=20, help="chunks per request")
+    parser.add_argument("--rpm", type=int, default=1200, help="requests-per-minute limit of the fake endpoint")
+    parser.add_argument("--tpm", type=int, default=5000000, help="tokens-per-minute limit of the fake endpoint")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds the fake endpoint takes per request")
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    tokenizer = tiktoken.get_encoding("cl100k_base")
+    texts = make_chunks(args.chunks, args.chunk_words)
+    n_tokens = [len(tokenizer.encode(text)) for text in texts]
+
+    process, base_url = start_fake_openai(args.rpm, args.tpm, args.latency)
+    client = OpenAI(api_key="fake", base_url=f"{base_url}/v1")
+    try:
+        serial = run("serial (1 worker)", client, texts, n_tokens, args.batch_inputs, args.rpm, args.tpm, 1)
+        concurrent = run(f"concurrent ({args.workers} workers)", client, texts, n_tokens, args.batch_inputs,
+                         args.rpm, args.tpm, args.workers)
+        run("over budget (2x limits)", client, texts, n_tokens, args.batch_inputs,
+            2 * args.rpm, 2 * args.tpm, args.workers)
+        stats = fake_stats(base_url)
+    finally:
+        process.terminate()
+    print(f"Speedup: {serial / concurrent:.2f}x; endpoint served {stats['requests']} requests "
+          f"and answered {stats['rate_limited']} with 429")
+
+if __name__ == "__main__":
+    main()
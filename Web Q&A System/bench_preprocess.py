@@ -0,0 +1,41 @@
+import argparse
+import time
+from bench_chunking import make_corpus
+from preprocess import preprocess_pages, PROCESSES
+
+# Benchmark: fingerprint, encode and chunk a synthetic corpus with 1, 2, 4, ... worker
+# processes, and check every run produces exactly the chunks of the single-process run
+
+def run(pages, processes, corpus_mb):
+    start = time.perf_counter()
+    chunks = list(preprocess_pages(pages, processes=processes))
+    elapsed = time.perf_counter() - start
+    print(f"{processes:3d} processes  {elapsed:8.2f}s  {len(pages) / elapsed:8.0f} pages/s  "
+          f"{corpus_mb / elapsed:7.2f} MB/s  {len(chunks):8d} chunks")
+    return elapsed, chunks
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how preprocessing scales with worker processes.")
+    parser.add_argument("--mb", type=float, default=50, help="corpus size in MB")
+    parser.add_argument("--page-kb", type=float, default=5, help="average page size in KB")
+    parser.add_argument("--max-processes", type=int, default=PROCESSES)
+    args = parser.parse_args()
+
+    pages = make_corpus(int(args.mb * 1e6), int(args.page_kb * 1e3))
+    corpus_mb = sum(len(text) for _, text in pages) / 1e6
+    print(f"Corpus: {len(pages)} pages, {corpus_mb:.1f} MB")
+
+    counts = [1]
+    while counts[-1] * 2 <= args.max_processes:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != args.max_processes:
+        counts.append(args.max_processes)
+
+    baseline, expected = run(pages, 1, corpus_mb)
+    for processes in counts[1:]:
+        elapsed, chunks = run(pages, processes, corpus_mb)
+        print(f"             speedup {baseline / elapsed:.2f}x ({baseline / elapsed / processes * 100:.0f}% of linear), "
+              f"{'output identical' if chunks == expected else 'OUTPUT DIFFERS'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+import numpy as np
+import pandas as pd
+from fake_openai import fake_embedding, start_fake_openai
+from index_store import save_index
+
+# Load test: concurrent clients asking distinct questions (so no cache answers them) of the
+# Flask app and of the async mode, both backed by the fake OpenAI endpoint with a fixed
+# latency per call. The Flask app runs behind a fixed pool of worker threads, like a
+# sync-worker deployment, and behind the development server's thread per request (app.run).
+# The async mode matches app.run's throughput rather than beating it: both are limited by the
+# CPU each question costs. Neither waits for a free thread, unlike the fixed pool
+
+HOST = "127.0.0.1"
+
+def build_index(n_chunks):
+    texts = [f"Page {i} explains topic {i % 97} of the website in a few words." for i in range(n_chunks)]
+    meta = pd.DataFrame({"filename": [f"page-{i}" for i in range(n_chunks)], "text": texts, "n_tokens": 16})
+    save_index(meta, np.stack([fake_embedding(text) for text in texts]), model="text-embedding-3-small")
+
+# Function to serve a WSGI app with `workers` threads; further requests queue for a free thread
+def make_pooled_server(app, workers):
+    from werkzeug.serving import BaseWSGIServer
+
+    class PooledWSGIServer(BaseWSGIServer):
+        pool = ThreadPoolExecutor(workers)
+
+        def process_request(self, request, client_address):
+            self.pool.submit(self.process_request_thread, request, client_address)
+
+        def process_request_thread(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    return PooledWSGIServer(HOST, 0, app)
+
+def serve_flask(port_queue, workers):
+    from werkzeug.serving import make_server
+    from app import app
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server(HOST, 0, app, threaded=True) if workers is None else make_pooled_server(app, workers)
+    server.request_queue_size = 1024
+    port_queue.put(server.port)
+    server.serve_forever()
+
+def serve_async(port_queue):
+    from aiohttp import web
+    from async_app import make_app
+
+    async def serve():
+        runner = web.AppRunner(make_app())
+        await runner.setup()
+        site = web.TCPSite(runner, HOST, 0, backlog=1024)
+        await site.start()
+        port_queue.put(runner.addresses[0][1])
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+def start_server(target, *args):
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=target, args=(port_queue, *args), daemon=True)
+    process.start()
+    return process, f"http://{HOST}:{port_queue.get()}"
+
+# Function to tell whether a response is a failed answer rather than one from the model
+def failed(status, body):
+    return status != 200 or "Error:" in body or "No embeddings found" in body
+
+# Function to ask one question before timing, so the server has loaded the index
+async def warm_up(base_url, attempts=50):
+    async with aiohttp.ClientSession() as session:
+        for i in range(attempts):
+            async with session.post(f"{base_url}/", data={"question": f"warm-up question {i}?"}) as response:
+                if not failed(response.status, await response.text()):
+                    return
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"{base_url} did not answer a question")
+
+async def load(base_url, label, n_requests, concurrency):
+    latencies, errors = [], 0
+    questions = iter(range(n_requests))
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=600)
+
+    async def client(session):
+        nonlocal errors
+        for i in questions:
+            start = time.perf_counter()
+            try:
+                async with session.post(f"{base_url}/", data={"question": f"{label} question {i}?"}) as response:
+                    body = await response.text()
+                    if failed(response.status, body):
+                        errors += 1
+            except aiohttp.ClientError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return n_requests / elapsed, np.percentile(latencies, 50), np.percentile(latencies, 95), errors
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the throughput of the Flask app and the async mode.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64, 256])
+    parser.add_argument("--requests-per-client", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds the fake endpoint takes per call")
+    parser.add_argument("--workers", type=int, default=8, help="worker threads of the pooled Flask server")
+    parser.add_argument("--chunks", type=int, default=2000, help="chunks in the test index")
+    args = parser.parse_args()
+
+    directory = tempfile.TemporaryDirectory()
+    os.chdir(directory.name)
+    build_index(args.chunks)
+    fake, fake_url = start_fake_openai(10 ** 9, 10 ** 12, args.latency)
+    os.environ["OPENAI_BASE_URL"] = f"{fake_url}/v1"
+    os.environ.setdefault("API_KEY", "fake")
+
+    servers = [
+        (f"flask {args.workers} threads", serve_flask, (args.workers,)),
+        ("flask thread/request", serve_flask, (None,)),
+        ("async", serve_async, ()),
+    ]
+    print(f"Fake OpenAI latency {args.latency}s per call; every question makes 2 calls")
+    print(f"{'server':<22} {'clients':>7} {'requests/s':>10} {'p50':>8} {'p95':>8} {'errors':>6}")
+    try:
+        for label, target, server_args in servers:
+            process, base_url = start_server(target, *server_args)
+            asyncio.run(warm_up(base_url))
+            for concurrency in args.concurrency:
+                n_requests = concurrency * args.requests_per_client
+                throughput, p50, p95, errors = asyncio.run(
+                    load(base_url, f"{label} {concurrency}", n_requests, concurrency))
+                print(f"{label:<22} {concurrency:>7} {throughput:>10.1f} {p50:>7.2f}s {p95:>7.2f}s {errors:>6}")
+            process.terminate()
+    finally:
+        fake.terminate()
+        os.chdir("/")
+        directory.cleanup()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import argparse
+import time
+from urllib.parse import urlparse
+import requests
+from bs4 import BeautifulSoup
+from bench_site import site_stats, start_site
+from crawler import get_domain_hyperlinks, process_page
+
+# Benchmark: per-page cost of the old double fetch (requests + urllib) versus the
+# single-fetch page processor, measured against the local synthetic site
+
+def double_fetch(local_domain, url):
+    text = BeautifulSoup(requests.get(url, headers={'User-Agent': 'Mozilla/5.0'}).text, "html.parser").get_text()
+    return text, get_domain_hyperlinks(local_domain, url)
+
+def single_fetch(local_domain, url):
+    response = requests.get(url, headers={'User-Agent': 'Mozilla/5.0'})
+    page = process_page(local_domain, url, response.text, response.headers.get("Content-Type", ""))
+    return page.text, page.links
+
+def run(label, fetch, urls, base_url):
+    before = site_stats(base_url)
+    start = time.perf_counter()
+    for url in urls:
+        fetch(url)
+    elapsed = time.perf_counter() - start
+    after = site_stats(base_url)
+    requests_per_page = (after["requests"] - before["requests"]) / len(urls)
+    kib_per_page = (after["bytes"] - before["bytes"]) / len(urls) / 1024
+    print(f"{label:<14} {elapsed / len(urls) * 1000:8.2f} ms/page  "
+          f"{requests_per_page:4.1f} requests/page  {kib_per_page:8.1f} KiB/page")
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare double-fetch and single-fetch page processing.")
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--size", type=int, default=20000, help="approximate page body size in bytes")
+    parser.add_argument("--latency", type=float, default=0.02, help="simulated server latency in seconds")
+    args = parser.parse_args()
+
+    process, base_url = start_site(args.pages, size=args.size, latency=args.latency)
+    local_domain = urlparse(base_url).netloc
+    urls = [f"{base_url}/page/{i}" for i in range(args.pages)]
+
+    try:
+        before = run("double fetch", lambda url: double_fetch(local_domain, url), urls, base_url)
+        after = run("single fetch", lambda url: single_fetch(local_domain, url), urls, base_url)
+    finally:
+        process.terminate()
+    print(f"Speedup: {before / after:.2f}x")
+
+if __name__ == "__main__":
+    main()
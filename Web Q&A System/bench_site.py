@@ -0,0 +1,125 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import random
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in website for offline crawler benchmarks. Pages are generated on the fly from
+# their number, so any page count costs no memory, and the server runs in its own process
+# so it does not compete with the crawler for the GIL
+
+WORDS = ("crawler embedding context question answer website page token vector model "
+         "search index document chunk latency server request response cache network").split()
+
+def make_page(i, n_pages, fan_out, size):
+    rng = random.Random(i)
+    targets = [(i + 1) % n_pages] + [rng.randrange(n_pages) for _ in range(fan_out - 1)]
+    links = "".join(f'<li><a href="/page/{t}">Page {t}</a></li>' for t in targets)
+    paragraphs = []
+    length = 0
+    while length < size:
+        sentence = " ".join(rng.choice(WORDS) for _ in range(12)).capitalize() + ". "
+        paragraphs.append(sentence)
+        length += len(sentence)
+    return (
+        f"<html><head><title>Page {i}</title></head><body>"
+        f"<nav><ul>{links}</ul></nav>"
+        f"<main><h1>Page {i}</h1><p>{''.join(paragraphs)}</p></main>"
+        f"<footer>Synthetic site footer</footer></body></html>"
+    ).encode()
+
+def make_handler(n_pages, fan_out, size, latency, error_rate, seed):
+    stats = {"requests": 0, "bytes": 0, "status": {}, "paths": {}}
+    lock = threading.Lock()
+    rng = random.Random(seed)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def respond(self, status, body=b"", headers=()):
+            self.send_response(status)
+            for key, value in headers:
+                self.send_header(key, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            with lock:
+                stats["requests"] += 1
+                stats["bytes"] += len(body)
+                stats["status"][status] = stats["status"].get(status, 0) + 1
+                stats["paths"][self.path] = stats["paths"].get(self.path, 0) + 1
+
+        def do_GET(self):
+            if self.path == "/__stats":
+                with lock:
+                    duplicates = sum(count - 1 for count in stats["paths"].values())
+                    body = json.dumps({"requests": stats["requests"], "bytes": stats["bytes"],
+                                       "status": stats["status"], "duplicates": duplicates}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+
+            time.sleep(latency)
+            parts = self.path.strip("/").split("/")
+            if len(parts) != 2 or parts[0] != "page" or not parts[1].isdigit() or int(parts[1]) >= n_pages:
+                self.respond(404)
+                return
+            with lock:
+                failed = rng.random() < error_rate
+            if failed:
+                self.respond(500)
+                return
+
+            body = make_page(int(parts[1]), n_pages, fan_out, size)
+            etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+            if self.headers.get("If-None-Match") == etag:
+                self.respond(304, headers=[("ETag", etag)])
+                return
+            self.respond(200, body, [("Content-Type", "text/html; charset=utf-8"), ("ETag", etag)])
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+def serve(port_queue, n_pages, fan_out, size, latency, error_rate, seed):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(n_pages, fan_out, size, latency, error_rate, seed))
+    server.daemon_threads = True
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+# Function to start the synthetic site in a child process; returns the process and the site root URL
+def start_site(n_pages=1000, fan_out=10, size=5000, latency=0.01, error_rate=0.0, seed=0):
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=serve, args=(port_queue, n_pages, fan_out, size, latency, error_rate, seed), daemon=True
+    )
+    process.start()
+    return process, f"http://127.0.0.1:{port_queue.get()}"
+
+def site_stats(base_url):
+    with urllib.request.urlopen(f"{base_url}/__stats") as response:
+        return json.loads(response.read())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a synthetic website for crawler benchmarks.")
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--fan-out", type=int, default=10)
+    parser.add_argument("--size", type=int, default=5000, help="approximate main content size in bytes")
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of page requests answered with 500")
+    args = parser.parse_args()
+
+    process, base_url = start_site(args.pages, args.fan_out, args.size, args.latency, args.error_rate)
+    print(f"Serving {args.pages} pages at {base_url}/page/0 (Ctrl+C to stop)")
+    try:
+        process.join()
+    except KeyboardInterrupt:
+        process.terminate()
@@ -0,0 +1,94 @@
+import os
+import re
+import numpy as np
+import tiktoken
+
+# Tokenizer and chunking settings
+tokenizer = tiktoken.get_encoding("cl100k_base")
+MAX_TOKENS = 500
+CHUNK_OVERLAP = 0
+ENCODE_BATCH_SIZE = 256
+ENCODE_THREADS = os.cpu_count() or 1
+
+# Sentences are separated by ". "
+SENTENCE_END = re.compile(rb"\. ")
+
+_token_byte_lengths = None
+
+# Function to return the UTF-8 byte length of every token id, built once per process
+def token_byte_lengths():
+    global _token_byte_lengths
+    if _token_byte_lengths is None:
+        lengths = np.zeros(tokenizer.n_vocab, dtype=np.int64)
+        for token in range(tokenizer.n_vocab):
+            try:
+                lengths[token] = len(tokenizer.decode_single_token_bytes(token))
+            except KeyError:
+                pass
+        _token_byte_lengths = lengths
+    return _token_byte_lengths
+
+# Function to cut one already-encoded document into chunks of at most `max_tokens` tokens at
+# sentence boundaries. Boundaries are mapped to token positions through the cumulative byte
+# length of the tokens, so nothing is re-encoded; yields (chunk text, n_tokens). A sentence
+# longer than `max_tokens` is split into token windows instead of being dropped, and every
+# chunk after the first repeats the last `overlap` tokens of the chunk before it
+def chunk_tokens(text, tokens, max_tokens=MAX_TOKENS, overlap=CHUNK_OVERLAP):
+    if len(tokens) <= max_tokens:
+        if text.strip():
+            yield text, len(tokens)
+        return
+
+    data = text.encode("utf-8")
+    token_ends = np.cumsum(token_byte_lengths()[np.asarray(tokens)])
+    # Byte offset right after each sentence's period, then the end of the text
+    byte_bounds = [m.start() + 1 for m in SENTENCE_END.finditer(data)] + [len(data)]
+    sentence_ends = np.minimum(np.searchsorted(token_ends, byte_bounds, side="left") + 1, len(tokens))
+
+    def span(start, end):
+        byte_start = int(token_ends[start - 1]) if start else 0
+        return data[byte_start:int(token_ends[end - 1])].decode("utf-8", errors="ignore").strip(), end - start
+
+    # The chunk being built covers tokens [chunk_start, chunk_end)
+    step = max_tokens - overlap
+    chunk_start = chunk_end = 0
+    for sentence_end in sentence_ends.tolist():
+        if sentence_end <= chunk_end:
+            continue
+        if sentence_end - chunk_end > max_tokens:
+            piece_ends = list(range(chunk_end + step, sentence_end, step)) + [sentence_end]
+        else:
+            piece_ends = [sentence_end]
+        for piece_end in piece_ends:
+            if piece_end - chunk_start > max_tokens and chunk_end > chunk_start:
+                chunk, n_tokens = span(chunk_start, chunk_end)
+                if chunk:
+                    yield chunk, n_tokens
+                chunk_start = max(chunk_end - overlap, piece_end - max_tokens)
+            chunk_end = piece_end
+    chunk, n_tokens = span(chunk_start, chunk_end)
+    if chunk:
+        yield chunk, n_tokens
+
+# Function to lazily chunk a stream of documents, encoding each exactly once with tiktoken's
+# multithreaded batch encoder; `documents` is an iterable of (key, text) and (key, chunk text,
+# n_tokens) is yielded for every chunk in document order. Only `batch_size` documents are
+# held in memory at a time, so consumers can start on the first chunks right away
+def chunk_documents(documents, max_tokens=MAX_TOKENS, overlap=CHUNK_OVERLAP, batch_size=ENCODE_BATCH_SIZE,
+                    num_threads=ENCODE_THREADS):
+    if not 0 <= overlap < max_tokens:
+        raise ValueError(f"overlap must be between 0 and max_tokens - 1, got {overlap}")
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            yield from _chunk_batch(batch, max_tokens, overlap, num_threads)
+            batch = []
+    if batch:
+        yield from _chunk_batch(batch, max_tokens, overlap, num_threads)
+
+def _chunk_batch(batch, max_tokens, overlap, num_threads):
+    encoded = tokenizer.encode_ordinary_batch([text for _, text in batch], num_threads=num_threads)
+    for (key, text), tokens in zip(batch, encoded):
+        for chunk, n_tokens in chunk_tokens(text, tokens, max_tokens, overlap):
+            yield key, chunk, n_tokens
@@ -1,54 +1,57 @@
 import os
-import pandas as pd
 import tiktoken
-import numpy as np
 from openai import OpenAI
-from ast import literal_eval
-from typing import List
-from scipy import spatial
 from embedding import generate_embeddings
 from crawler import crawl_website
+from index_store import load_index
+from ann import N_PROBE
+from answer_cache import SemanticAnswerCache
+from query_cache import open_query_cache
+from retrieval import SearchIndex
 
 # Initialize OpenAI client
 client = OpenAI(api_key=os.getenv("API_KEY"))
 
-def distances_from_embeddings(query_embedding: List[float], embeddings: List[List[float]], distance_metric="cosine") -> List[float]:
-    distance_metrics = {
-        "cosine": spatial.distance.cosine,
-        "L1": spatial.distance.cityblock,
-        "L2": spatial.distance.euclidean,
-        "Linf": spatial.distance.chebyshev,
-    }
-    return [distance_metrics[distance_metric](query_embedding, embedding) for embedding in embeddings]
+# Embeddings of recent questions, kept in memory and on disk
+query_cache = open_query_cache()
 
-def create_context(question: str, df: pd.DataFrame, max_len: int = 1800, model: str = "text-embedding-3-small", distance_metric: str = "cosine"):
-    q_embeddings = client.embeddings.create(input=question, model=model).data[0].embedding
-    df['distances'] = distances_from_embeddings(q_embeddings, df['embeddings'].tolist(), distance_metric)
+# Answers to recent questions, reused for paraphrases while the index is unchanged
+answer_cache = SemanticAnswerCache()
 
-    returns, cur_len = [], 0
-    for _, row in df.sort_values('distances', ascending=True).iterrows():
-        cur_len += row['n_tokens'] + 4
-        if cur_len > max_len:
-            break
-        returns.append(row["text"])
-    
-    return "\n\n###\n\n".join(returns)
+# Function to embed a question with the API; repeated questions are served by `query_cache`
+def embed_query(question, model, dimensions):
+    options = {"dimensions": dimensions} if dimensions else {}
+    return client.embeddings.create(input=question, model=model, **options).data[0].embedding
+
+# The question is embedded with the model and dimensions the index was built with. Large
+# indexes are searched approximately; `n_probe` trades recall for latency
+def create_context(question: str, index: SearchIndex, max_len: int = 1800, model: str = "text-embedding-3-small", distance_metric: str = "cosine", n_probe: int = N_PROBE, q_embeddings=None):
+    if q_embeddings is None:
+        q_embeddings = query_cache.embedding(question, index.model or model, index.dimensions, embed_query)
+    return "\n\n###\n\n".join(index.context(q_embeddings, max_len, distance_metric, n_probe))
 
 def prepare_data():
-    if not os.path.exists('processed/embeddings.csv'):
+    index = load_index()
+    if index is None:
         print("Embeddings file not found. Starting web crawl and embedding generation.")
         full_url = input("Enter the website URL to crawl (e.g., https://openai.com/): ").strip()
         limit = int(input("Enter the maximum number of URLs to crawl: "))
         crawl_website(full_url, limit)
         generate_embeddings()
+        index = load_index()
     
-    df = pd.read_csv('processed/embeddings.csv', index_col=0)
-    df['embeddings'] = df['embeddings'].apply(literal_eval).apply(np.array)
-    return df
+    return SearchIndex(index) if index is not None else None
 
-def answer_question(df, question, model="gpt-4o-mini", max_len=1800, max_tokens=150):
-    # Create the context from the dataframe
-    context = create_context(question, df, max_len)
+def answer_question(index, question, model="gpt-4o-mini", max_len=1800, max_tokens=150):
+    # Reuse the answer to an earlier question that means the same, if there is one
+    q_embeddings = query_cache.embedding(question, index.model or "text-embedding-3-small", index.dimensions, embed_query)
+    settings = (model, max_len, max_tokens)
+    cached = answer_cache.get(index.version, settings, q_embeddings)
+    if cached is not None:
+        return cached
+
+    # Create the context from the index
+    context = create_context(question, index, max_len, q_embeddings=q_embeddings)
     
     try:
         # Create the chat completion request
@@ -67,21 +70,24 @@ def answer_question(df, question, model="gpt-4o-mini", max_len=1800, max_tokens=
 
         # If the answer is blank or non-informative, return "I don't know"
         if not answer or answer.lower() in ["", "i don't know", "i don’t know"]:
-            return "I don't know"
-        
+            answer = "I don't know"
+
+        answer_cache.put(index.version, settings, q_embeddings, answer)
         return answer
 
     except Exception as e:
         return f"Error: {e}"
 
 def answer_question_loop():
-    df = prepare_data()
+    index = prepare_data()
     while True:
         question = input("Ask a question (type 'exit' to quit): ").strip()
         if question.lower() == 'exit':
             print("Exiting.")
+            print(query_cache.summary())
+            print(answer_cache.summary())
             break
-        print(f"Answer: {answer_question(df, question)}")
+        print(f"Answer: {answer_question(index, question)}")
 
 if __name__ == "__main__":
     answer_question_loop()
@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import sqlite3
+from collections import namedtuple
+from urllib.parse import urlparse
+
+# Default location of the persisted crawl state
+STATE_PATH = "processed/crawl_state.db"
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+# The version of a page a crawl saw: its cache validators and the hash of its text
+PageVersion = namedtuple("PageVersion", ["url", "etag", "last_modified", "text_hash"], defaults=(None, None, None))
+
+# Per-URL validators (ETag, Last-Modified) and text hash of the version of each page that was
+# last indexed, and outgoing links from the last crawl, so a re-crawl can send conditional
+# requests and still follow links of unchanged pages. The crawler only records links: the
+# validators are stored by the embedding run that indexed the page, so a page whose text never
+# reached the index (the run failed, or the site was crawled again first) is emitted again.
+# The same store checkpoints the crawl frontier, the seen-set and the completed pages
+# so an interrupted crawl can be resumed without re-fetching anything it already finished
+class CrawlState:
+    def __init__(self, path=STATE_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, text_hash TEXT, links TEXT, simhash TEXT, duplicate_of TEXT)"
+        )
+        # State files written before near-duplicates were recorded lack the last two columns
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(pages)")}
+        for column in ("simhash", "duplicate_of"):
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE pages ADD COLUMN {column} TEXT")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS frontier (seq INTEGER PRIMARY KEY, url TEXT)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS seen (url TEXT PRIMARY KEY)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS done (seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "url TEXT UNIQUE, filename TEXT, status TEXT)"
+        )
+        self.conn.commit()
+
+    def get(self, url):
+        row = self.conn.execute(
+            "SELECT etag, last_modified, text_hash, links FROM pages WHERE url = ?", (url,)
+        ).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, hash_, links = row
+        return {"etag": etag, "last_modified": last_modified, "text_hash": hash_, "links": json.loads(links)}
+
+    def conditional_headers(self, url):
+        entry = self.get(url)
+        headers = {}
+        if entry and entry["text_hash"]:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    # Function to record the links of a crawled page, keeping its validators
+    def set_links(self, url, links):
+        self.conn.execute(
+            "INSERT INTO pages (url, links) VALUES (?, ?) ON CONFLICT (url) DO UPDATE SET links = excluded.links",
+            (url, json.dumps(sorted(links))),
+        )
+
+    # Function to record the versions of pages (PageVersion) that are now indexed
+    def mark_indexed(self, versions):
+        self.conn.executemany(
+            "INSERT INTO pages (url, etag, last_modified, text_hash, links) VALUES (?, ?, ?, ?, '[]') "
+            "ON CONFLICT (url) DO UPDATE SET etag = excluded.etag, last_modified = excluded.last_modified, "
+            "text_hash = excluded.text_hash",
+            versions,
+        )
+        self.conn.commit()
+
+    # Function to record the SimHash fingerprints of indexed pages, and of pages dropped as
+    # near-duplicates together with the URL of the page they duplicate, from (url, fingerprint,
+    # duplicate_of) rows
+    def set_fingerprints(self, rows):
+        self.conn.executemany(
+            "UPDATE pages SET simhash = ?, duplicate_of = ? WHERE url = ?",
+            ((format(fingerprint, "x") if fingerprint is not None else None, duplicate_of, url)
+             for url, fingerprint, duplicate_of in rows),
+        )
+        self.conn.commit()
+
+    # Function to return the fingerprints of indexed pages that are not near-duplicates, by URL
+    def fingerprints(self):
+        rows = self.conn.execute("SELECT url, simhash FROM pages WHERE simhash IS NOT NULL AND duplicate_of IS NULL")
+        return {url: int(simhash, 16) for url, simhash in rows}
+
+    # Function to return the pages recorded as near-duplicates, mapped to the page they duplicate
+    def duplicates(self):
+        return dict(self.conn.execute("SELECT url, duplicate_of FROM pages WHERE duplicate_of IS NOT NULL"))
+
+    # Function to drop pages that were removed from the site
+    def forget(self, urls):
+        self.conn.executemany("DELETE FROM pages WHERE url = ?", ((url,) for url in urls))
+        self.conn.commit()
+
+    # Function to clear the validators, text hash and fingerprint of pages, so the next crawl
+    # fetches them in full and emits their text again
+    def clear_validators(self, urls):
+        self.conn.executemany(
+            "UPDATE pages SET etag = NULL, last_modified = NULL, text_hash = NULL, simhash = NULL, duplicate_of = NULL "
+            "WHERE url = ?",
+            ((url,) for url in urls),
+        )
+        self.conn.commit()
+
+    # Function to return the URLs of every known page on `domain`
+    def urls(self, domain):
+        return [url for (url,) in self.conn.execute("SELECT url FROM pages") if urlparse(url).netloc == domain]
+
+    # Function to drop any previous checkpoint and start a new crawl from `root_url`, whose
+    # frontier is the root URL alone
+    def start_crawl(self, root_url):
+        self.conn.execute("DELETE FROM frontier")
+        self.conn.execute("DELETE FROM seen")
+        self.conn.execute("DELETE FROM done")
+        self.conn.execute("DELETE FROM meta WHERE key = 'shard_position'")
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('root_url', ?)", (root_url,))
+        self.conn.execute("INSERT INTO frontier (seq, url) VALUES (0, ?)", (root_url,))
+        self.conn.execute("INSERT INTO seen (url) VALUES (?)", (root_url,))
+        self.conn.commit()
+
+    # Function to load the last checkpoint: root URL, frontier (in queue order), seen-set,
+    # the completed pages as (url, filename, status) in crawl order and the output shard position
+    def load_checkpoint(self):
+        meta = dict(self.conn.execute("SELECT key, value FROM meta"))
+        if "root_url" not in meta:
+            return None
+        queue = [url for (url,) in self.conn.execute("SELECT url FROM frontier ORDER BY seq")]
+        seen = {url for (url,) in self.conn.execute("SELECT url FROM seen")}
+        done = self.conn.execute("SELECT url, filename, status FROM done ORDER BY seq").fetchall()
+        shard_position = json.loads(meta["shard_position"]) if "shard_position" in meta else None
+        return meta["root_url"], queue, seen, done, shard_position
+
+    # Function to persist the crawl progress together with the page updates made since the
+    # last checkpoint, in one transaction so a crash never leaves them out of step
+    def checkpoint(self, queue, new_seen, new_done, shard_position=None):
+        if shard_position is not None:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('shard_position', ?)", (json.dumps(shard_position),)
+            )
+        self.conn.execute("DELETE FROM frontier")
+        self.conn.executemany("INSERT INTO frontier (seq, url) VALUES (?, ?)", enumerate(queue))
+        self.conn.executemany("INSERT OR IGNORE INTO seen (url) VALUES (?)", ((url,) for url in new_seen))
+        self.conn.executemany("INSERT OR REPLACE INTO done (url, filename, status) VALUES (?, ?, ?)", new_done)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
@@ -1,12 +1,19 @@
-import requests
+import argparse
+import asyncio
+import aiohttp
 import re
 import urllib.request
-from bs4 import BeautifulSoup
-from collections import deque
+from collections import deque, namedtuple
 from html.parser import HTMLParser
 from urllib.parse import urlparse
 import os
-import pandas as pd
+import tiktoken
+from crawl_state import CrawlState, PageVersion, text_hash
+from shards import ShardWriter, SHARD_DIR
+from extract import DEFAULT_PARSER, extract_main_text, parse_html, visible_text
+
+# Tokenizer used to report the tokens saved by main-content extraction
+tokenizer = tiktoken.get_encoding("cl100k_base")
 
 # Regex pattern to match a URL
 HTTP_URL_PATTERN = r'^http[s]*://.+'
@@ -44,10 +51,10 @@ def get_hyperlinks(url):
     return parser.hyperlinks
 
 
-# Function to get the hyperlinks from a URL that are within the same domain
-def get_domain_hyperlinks(local_domain, url):
+# Function to keep only the links that point to the same domain
+def filter_domain_links(local_domain, links, scheme="https"):
     clean_links = []
-    for link in set(get_hyperlinks(url)):
+    for link in set(links):
         clean_link = None
         if re.search(HTTP_URL_PATTERN, link):
             url_obj = urlparse(link)
@@ -55,68 +62,254 @@ def get_domain_hyperlinks(local_domain, url):
                 clean_link = link
         else:
             if link.startswith("/"):
-                clean_link = f"https://{local_domain}/{link[1:]}"
+                clean_link = f"{scheme}://{local_domain}/{link[1:]}"
         if clean_link and clean_link.endswith("/"):
             clean_link = clean_link[:-1]
         if clean_link:
             clean_links.append(clean_link)
     return list(set(clean_links))
 
+# Function to get the hyperlinks from a URL that are within the same domain
+def get_domain_hyperlinks(local_domain, url):
+    return filter_domain_links(local_domain, get_hyperlinks(url), urlparse(url).scheme)
+
+# A processed page: visible text, same-domain links, the response content type, its cache
+# validators and the tokens main-content extraction removed; `changed` is False when the
+# server answered 304 Not Modified and `gone` is True when it answered 404 or 410
+Page = namedtuple(
+    "Page",
+    ["url", "text", "links", "content_type", "etag", "last_modified", "changed", "tokens_saved", "gone"],
+    defaults=(None, None, True, 0, False),
+)
+
+# Function to extract the text and the same-domain links from a single response body.
+# With `extract_main` set, navigation, footers, cookie banners and other page chrome are
+# dropped from the text after the links have been collected
+def process_page(local_domain, url, html, content_type, parser=DEFAULT_PARSER, extract_main=True):
+    if not content_type.startswith("text/"):
+        return Page(url, None, [], content_type)
+
+    soup = parse_html(html, parser)
+    if not content_type.startswith("text/html"):
+        return Page(url, soup.get_text(), [], content_type)
+
+    hrefs = [a["href"] for a in soup.find_all("a", href=True)]
+    links = filter_domain_links(local_domain, hrefs, urlparse(url).scheme)
+    if not extract_main:
+        return Page(url, soup.get_text(), links, content_type)
+
+    full_tokens = len(tokenizer.encode(visible_text(soup), disallowed_special=()))
+    text = extract_main_text(soup)
+    tokens_saved = full_tokens - len(tokenizer.encode(text, disallowed_special=()))
+    return Page(url, text, links, content_type, tokens_saved=tokens_saved)
+
 def remove_newlines(text):
     return text.replace('\n', ' ').replace('\\n', ' ').replace('  ', ' ')
 
-# Function to crawl the website and save the scraped data to a CSV file
-def crawl_website(full_url, limit):
-    local_domain = urlparse(full_url).netloc
-    queue = deque([full_url])
-    seen = set([full_url])
+# Function to return the name a crawled page is known by in the scraped data and the index
+def page_filename(local_domain, url):
+    return f'text/{local_domain}/{url[8:].replace("/", "_")}.txt'
+
+# Concurrency settings for the crawl engine
+MAX_CONCURRENCY = 20
+MAX_PER_HOST = 8
+REQUEST_TIMEOUT = 30
+CHECKPOINT_EVERY = 50
 
-    if not os.path.exists(f"text/{local_domain}/"):
-        os.makedirs(f"text/{local_domain}/")
+# Responses meaning a page was removed from the site
+GONE_STATUSES = (404, 410)
+
+# Function to fetch a single page once and process its body, sending conditional
+# request headers when the page is already known to the crawl state
+async def fetch_page(session, local_domain, url, state=None, parser=DEFAULT_PARSER, extract_main=True):
+    print(f"Crawling: {url}")
+    headers = state.conditional_headers(url) if state else {}
+    try:
+        async with session.get(url, headers=headers) as response:
+            content_type = response.headers.get("Content-Type", "")
+            if response.status == 304:
+                entry = state.get(url)
+                return Page(url, None, entry["links"], content_type, entry["etag"], entry["last_modified"], False)
+            if response.status in GONE_STATUSES:
+                print(f"Page {url} no longer exists ({response.status}).")
+                return Page(url, None, [], content_type, gone=True)
+            if response.status >= 400:
+                # Other errors may be transient: the page is skipped, not treated as removed
+                print(f"Error fetching {url}: HTTP {response.status}")
+                return None
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+            html = await response.text()
+        page = await asyncio.to_thread(process_page, local_domain, url, html, content_type, parser, extract_main)
+    except Exception as e:
+        print(f"Error fetching {url}: {e}")
+        return None
+
+    if page.text is None:
+        print(f"Skipping {url} due to content type {content_type}.")
+        return None
+    if "You need to enable JavaScript to run this app." in page.text:
+        print(f"Skipping {url} due to JavaScript requirement.")
+        return None
+    return page._replace(etag=etag, last_modified=last_modified)
+
+# Asynchronous crawl engine: keeps up to `concurrency` pages in flight over a pooled,
+# keep-alive connector that opens at most `per_host` connections to any single host.
+# With `incremental` set, pages whose content did not change since they were last indexed are
+# emitted with status "unchanged" and no text, so only new or changed pages get re-embedded.
+# Pages are streamed into compressed, rotating shards under processed/scraped as they are
+# crawled. Progress is checkpointed every `checkpoint_every` pages; `resume` continues the last crawl
+async def crawl_website_async(full_url, limit, concurrency=MAX_CONCURRENCY, per_host=MAX_PER_HOST,
+                              incremental=True, resume=False, checkpoint_every=CHECKPOINT_EVERY,
+                              parser=DEFAULT_PARSER, extract_main=True):
     if not os.path.exists("processed"):
         os.makedirs("processed")
 
-    url_count = 0
-    texts = []
-
-    while queue and url_count < limit:
-        url = queue.pop()
-        print(f"Crawling: {url}")
-        try:
-            headers = {'User-Agent': 'Mozilla/5.0'}
-            soup = BeautifulSoup(requests.get(url, headers=headers).text, "html.parser")
-            text = soup.get_text()
-            if "You need to enable JavaScript to run this app." in text:
-                print(f"Skipping {url} due to JavaScript requirement.")
-                continue
-
-            # Save the text to a file
-            filename = f'text/{local_domain}/{url[8:].replace("/", "_")}.txt'
-            with open(filename, "w") as f:
-                f.write(text)
-            
-            texts.append((filename, remove_newlines(text)))
-            url_count += 1
-        except Exception as e:
-            print(f"Error fetching {url}: {e}")
-            continue
-
-        for link in get_domain_hyperlinks(local_domain, url):
-            if link not in seen and url_count < limit:
-                queue.append(link)
-                seen.add(link)
-
-    # After crawling, write all the scraped data into a CSV file
-    if texts:
-        df = pd.DataFrame(texts, columns=['filename', 'text'])
-        df.to_csv('processed/scraped.csv', index=False)
-        print(f"Scraped data saved to 'processed/scraped.csv'.")
+    state = CrawlState()
+    checkpoint = state.load_checkpoint() if resume else None
+    if checkpoint and full_url in (None, checkpoint[0]):
+        full_url, queue, seen, done, shard_position = checkpoint
+        queue = deque(queue)
+        url_count = sum(1 for _, _, status in done if status not in ("gone", "failed"))
+        n_unchanged = sum(1 for _, _, status in done if status == "unchanged")
+        n_gone = sum(1 for _, _, status in done if status == "gone")
+        n_failed = len(done) - url_count - n_gone
+        new_seen = [full_url]
+        print(f"Resuming crawl of {full_url}: {len(done)} pages done, {len(queue)} queued.")
+    else:
+        if resume:
+            print("No checkpoint to resume from, starting a new crawl.")
+        if full_url is None:
+            state.close()
+            return
+        queue = deque([full_url])
+        seen = set([full_url])
+        url_count = n_unchanged = n_gone = n_failed = 0
+        shard_position = None
+        new_seen = []
+        state.start_crawl(full_url)
+
+    local_domain = urlparse(full_url).netloc
+    writer = ShardWriter(position=shard_position)
+    tokens_saved = 0
+    pending = {}
+    new_done = []
+
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=per_host)
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    headers = {'User-Agent': 'Mozilla/5.0'}
+    try:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers) as session:
+            while (queue or pending) and url_count < limit:
+                # Never have more pages in flight than could still count towards the limit
+                while queue and len(pending) < concurrency and url_count + len(pending) < limit:
+                    url = queue.pop()
+                    task = fetch_page(session, local_domain, url, state if incremental else None, parser, extract_main)
+                    pending[asyncio.create_task(task)] = url
+
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    url = pending.pop(task)
+                    page = task.result()
+                    if page is None:
+                        new_done.append((url, None, "failed"))
+                        n_failed += 1
+                        continue
+
+                    filename = page_filename(local_domain, url)
+                    if page.gone:
+                        writer.write({"url": url, "filename": filename, "text": "", "status": "gone"})
+                        new_done.append((url, filename, "gone"))
+                        n_gone += 1
+                        continue
+                    previous = state.get(url)
+                    if not page.changed:
+                        hash_ = previous["text_hash"]
+                        status = "unchanged"
+                    else:
+                        hash_ = text_hash(page.text)
+                        if previous is None or previous["text_hash"] is None:
+                            status = "new"
+                        elif incremental and previous["text_hash"] == hash_:
+                            status = "unchanged"
+                        else:
+                            status = "changed"
+                    state.set_links(url, page.links)
+
+                    # The version is stored in the crawl state once an embedding run indexed it
+                    record = {"url": url, "filename": filename, "status": status,
+                              **PageVersion(url, page.etag, page.last_modified, hash_)._asdict()}
+                    if status == "unchanged":
+                        writer.write({**record, "text": ""})
+                        n_unchanged += 1
+                    else:
+                        writer.write({**record, "text": remove_newlines(page.text)})
+                    if page.tokens_saved:
+                        print(f"Main content of {url}: {page.tokens_saved} tokens of page chrome removed.")
+                        tokens_saved += page.tokens_saved
+                    new_done.append((url, filename, status))
+                    url_count += 1
+
+                    for link in page.links:
+                        if link not in seen and url_count < limit:
+                            queue.append(link)
+                            seen.add(link)
+                            new_seen.append(link)
+
+                    if len(new_done) >= checkpoint_every:
+                        state.checkpoint(list(queue) + list(pending.values()), new_seen, new_done, writer.flush())
+                        new_seen, new_done = [], []
+
+            # When every reachable page was fetched, known pages of the site the crawl no longer
+            # reached were unlinked from it. After a fetch error or at the limit, pages may just
+            # not have been reached, so nothing is concluded
+            if not queue and not pending and url_count < limit and not n_failed:
+                for url in state.urls(local_domain):
+                    if url not in seen:
+                        writer.write({"url": url, "filename": page_filename(local_domain, url), "text": "", "status": "gone"})
+                        n_gone += 1
+
+            for task in pending:
+                task.cancel()
+    finally:
+        # Pages still in flight go back on the frontier, so they are the next ones fetched
+        state.checkpoint(list(queue) + list(pending.values()), new_seen, new_done, writer.close())
+        state.close()
+
+    if url_count:
+        print(f"Scraped data saved to '{SHARD_DIR}/'.")
     else:
         print("No data scraped.")
+    print(f"Finished crawling. Total URLs crawled: {url_count} ({url_count - n_unchanged} new or changed, {n_unchanged} unchanged, "
+          f"{n_gone} removed)")
+    if extract_main:
+        print(f"Main-content extraction saved {tokens_saved} tokens.")
 
-    print(f"Finished crawling. Total URLs crawled: {url_count}")
+# Function to crawl the website and save the scraped data to compressed shards
+def crawl_website(full_url, limit, concurrency=MAX_CONCURRENCY, per_host=MAX_PER_HOST,
+                  incremental=True, resume=False, checkpoint_every=CHECKPOINT_EVERY,
+                  parser=DEFAULT_PARSER, extract_main=True):
+    asyncio.run(crawl_website_async(full_url, limit, concurrency, per_host, incremental, resume, checkpoint_every,
+                                    parser, extract_main))
 
 if __name__ == "__main__":
-    full_url = input("Enter the website URL to crawl: ").strip()
-    limit = int(input("Enter the maximum number of URLs to crawl: "))
-    crawl_website(full_url, limit)
+    parser = argparse.ArgumentParser(description="Crawl a website and save the scraped text.")
+    parser.add_argument("url", nargs="?", help="website URL to crawl")
+    parser.add_argument("--limit", type=int, help="maximum number of URLs to crawl")
+    parser.add_argument("--resume", action="store_true", help="continue the last interrupted crawl")
+    parser.add_argument("--full", action="store_true", help="re-fetch and re-emit every page, ignoring the crawl state")
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENCY)
+    parser.add_argument("--per-host", type=int, default=MAX_PER_HOST)
+    parser.add_argument("--checkpoint-every", type=int, default=CHECKPOINT_EVERY)
+    parser.add_argument("--parser", default=DEFAULT_PARSER, help="BeautifulSoup parser, e.g. lxml or html.parser")
+    parser.add_argument("--no-extract", action="store_true", help="keep the full page text instead of its main content")
+    args = parser.parse_args()
+
+    full_url = args.url
+    if full_url is None and not args.resume:
+        full_url = input("Enter the website URL to crawl: ").strip()
+    limit = args.limit
+    if limit is None:
+        limit = int(input("Enter the maximum number of URLs to crawl: "))
+    crawl_website(full_url, limit, args.concurrency, args.per_host, not args.full, args.resume, args.checkpoint_every,
+                  args.parser, not args.no_extract)
@@ -0,0 +1,63 @@
+import hashlib
+import re
+import numpy as np
+
+# Near-duplicate detection settings: word shingle size and the largest Hamming distance
+# between two 64-bit SimHash fingerprints that still counts as a near-duplicate
+SHINGLE_SIZE = 5
+MAX_DISTANCE = 3
+
+def shingles(text, size=SHINGLE_SIZE):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+# Function to compute the 64-bit SimHash of a text from its hashed word shingles
+def simhash(text, size=SHINGLE_SIZE):
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") for s in shingles(text, size)),
+        dtype=np.uint64,
+    )
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    fingerprint = np.packbits(bits.sum(axis=0) * 2 > len(hashes), bitorder="little")
+    return int.from_bytes(fingerprint.tobytes(), "little")
+
+# LSH index over SimHash fingerprints. The 64 bits are cut into `max_distance + 1` bands,
+# so any two fingerprints within `max_distance` bits agree on at least one whole band and
+# only texts sharing a band are compared
+class NearDuplicateIndex:
+    def __init__(self, max_distance=MAX_DISTANCE, shingle_size=SHINGLE_SIZE):
+        self.max_distance = max_distance
+        self.shingle_size = shingle_size
+        n_bands = max_distance + 1
+        edges = [round(i * 64 / n_bands) for i in range(n_bands + 1)]
+        self.bands = [((1 << (hi - lo)) - 1, lo) for lo, hi in zip(edges, edges[1:])]
+        self.tables = [{} for _ in self.bands]
+        self.fingerprints = {}
+
+    def _keys(self, fingerprint):
+        return [(fingerprint >> shift) & mask for mask, shift in self.bands]
+
+    # Function to return the key of an indexed near-duplicate of `text`, or index it under `key`;
+    # a `fingerprint` already computed with simhash (e.g. in a worker process) skips hashing the text
+    def add(self, key, text, fingerprint=None):
+        if fingerprint is None:
+            fingerprint = simhash(text, self.shingle_size)
+        band_keys = self._keys(fingerprint)
+        for table, band_key in zip(self.tables, band_keys):
+            for candidate in table.get(band_key, ()):
+                if bin(fingerprint ^ self.fingerprints[candidate]).count("1") <= self.max_distance:
+                    return candidate
+        self.fingerprints[key] = fingerprint
+        for table, band_key in zip(self.tables, band_keys):
+            table.setdefault(band_key, []).append(key)
+        return None
+
+    # Function to take the page indexed under `key` out of the index, e.g. before it is added
+    # again with the fingerprint of its new text
+    def remove(self, key):
+        if key not in self.fingerprints:
+            return
+        for table, band_key in zip(self.tables, self._keys(self.fingerprints.pop(key))):
+            table[band_key].remove(key)
@@ -0,0 +1,169 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import openai
+
+# Default budgets (per minute), concurrency and retry settings of the embedding scheduler
+REQUESTS_PER_MINUTE = 3000
+TOKENS_PER_MINUTE = 1000000
+MAX_WORKERS = 8
+MAX_RETRIES = 6
+BURST_SECONDS = 1.0
+PROGRESS_INTERVAL = 5.0
+
+# Per-request limits of the embeddings endpoint
+MAX_BATCH_INPUTS = 2048
+MAX_BATCH_TOKENS = 300000
+
+# Errors worth retrying a batch for; anything else (e.g. a bad request) fails right away
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)
+
+# Function to pack a stream of items into consecutive batches that stay within the
+# per-request input and token limits; `size` gives the token count of an item. Items are
+# pulled lazily, so only the batch being filled is held in memory
+def pack_stream(items, size, max_inputs=MAX_BATCH_INPUTS, max_batch_tokens=MAX_BATCH_TOKENS):
+    batch, batch_tokens = [], 0
+    for item in items:
+        n = size(item)
+        if batch and (len(batch) >= max_inputs or batch_tokens + n > max_batch_tokens):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(item)
+        batch_tokens += n
+    if batch:
+        yield batch
+
+# Function to pack consecutive rows into batches; yields the row positions of each batch
+def pack_batches(n_tokens, max_inputs=MAX_BATCH_INPUTS, max_batch_tokens=MAX_BATCH_TOKENS):
+    for batch in pack_stream(enumerate(n_tokens), lambda row: row[1], max_inputs, max_batch_tokens):
+        yield [i for i, _ in batch]
+
+# Two continuously refilled buckets, one for requests and one for tokens. They hold
+# `burst` seconds worth of budget, since the API enforces its per-minute limits over much
+# shorter windows. A batch larger than the bucket is let through once the bucket is full
+# and leaves it in debt, which later requests wait out
+class RateLimiter:
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE, burst=BURST_SECONDS):
+        self.request_rate = requests_per_minute / 60
+        self.token_rate = tokens_per_minute / 60
+        self.request_capacity = max(1.0, self.request_rate * burst)
+        self.token_capacity = max(1.0, self.token_rate * burst)
+        self.requests = self.request_capacity
+        self.tokens = self.token_capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.condition = threading.Condition()
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        self.requests = min(self.request_capacity, self.requests + elapsed * self.request_rate)
+        self.tokens = min(self.token_capacity, self.tokens + elapsed * self.token_rate)
+        self.updated = now
+
+    def acquire(self, tokens):
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                needed = min(tokens, self.token_capacity)
+                wait = max(
+                    self.paused_until - now,
+                    (1 - self.requests) / self.request_rate,
+                    (needed - self.tokens) / self.token_rate,
+                )
+                if wait <= 0:
+                    self.requests -= 1
+                    self.tokens -= tokens
+                    return
+                self.condition.wait(wait)
+
+    # Function to hold back every worker, e.g. after the API answered 429
+    def pause(self, seconds):
+        with self.condition:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+def retry_after(error):
+    try:
+        return float(error.response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+# Concurrent embedding scheduler: keeps up to `max_workers` batch requests in flight while
+# staying inside the requests-per-minute and tokens-per-minute budgets, backs off
+# exponentially (or as told by Retry-After) on 429s and reports progress and throughput
+class EmbeddingScheduler:
+    def __init__(self, client, model, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE,
+                 max_workers=MAX_WORKERS, max_retries=MAX_RETRIES, progress_interval=PROGRESS_INTERVAL, dimensions=None):
+        # The scheduler does its own retrying, so the client must not retry 429s behind its back
+        self.client = client.with_options(max_retries=0)
+        self.model = model
+        # Reduced output width (text-embedding-3 models only); None keeps the model's full width
+        self.options = {"dimensions": dimensions} if dimensions else {}
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.progress_interval = progress_interval
+        self.lock = threading.Lock()
+        self.started = None
+        self.last_report = 0.0
+        self.n_requests = self.n_inputs = self.n_tokens = self.n_rate_limited = 0
+
+    def embed_batch(self, texts, n_tokens):
+        if not texts:
+            return []
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(n_tokens)
+            try:
+                response = self.client.embeddings.create(input=texts, model=self.model, **self.options)
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = min(60.0, 2 ** attempt) * (0.5 + random.random())
+                if isinstance(e, openai.RateLimitError):
+                    delay = retry_after(e) or delay
+                    self.limiter.pause(delay)
+                    with self.lock:
+                        self.n_rate_limited += 1
+                else:
+                    print(f"Embedding batch of {len(texts)} failed ({e}); retrying in {delay:.1f}s.")
+                time.sleep(delay)
+                continue
+            self._record(len(texts), n_tokens)
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    def _record(self, n_inputs, n_tokens):
+        with self.lock:
+            self.n_requests += 1
+            self.n_inputs += n_inputs
+            self.n_tokens += n_tokens
+            now = time.monotonic()
+            if now - self.last_report >= self.progress_interval:
+                self.last_report = now
+                print(self.summary())
+
+    def summary(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return (f"Embedded {self.n_inputs} chunks in {self.n_requests} requests "
+                f"({self.n_requests / elapsed * 60:.0f} requests/min, {self.n_tokens / elapsed * 60:.0f} tokens/min, "
+                f"{self.n_rate_limited} rate-limited)")
+
+    # Function to embed an iterable of (texts, n_tokens) batches concurrently; yields the
+    # embeddings of each batch in submission order. Batches are pulled lazily, so at most a
+    # couple of batches per worker are held in memory at any time
+    def map(self, batches):
+        self.started = time.monotonic()
+        self.last_report = self.started
+        executor = ThreadPoolExecutor(self.max_workers)
+        futures = deque()
+        try:
+            for texts, n_tokens in batches:
+                futures.append(executor.submit(self.embed_batch, texts, n_tokens))
+                if len(futures) >= 2 * self.max_workers:
+                    yield futures.popleft().result()
+            while futures:
+                yield futures.popleft().result()
+        finally:
+            executor.shutdown(cancel_futures=True)
+            print(self.summary())
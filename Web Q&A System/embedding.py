@@ -1,8 +1,22 @@
+import argparse
 import os
+from collections import deque
+from itertools import chain
+from urllib.parse import urlparse
+import numpy as np
 import pandas as pd
-import tiktoken
 from openai import OpenAI
 from dotenv import load_dotenv
+from crawler import page_filename, remove_newlines
+from crawl_state import CrawlState, PageVersion
+from shards import iter_records, shard_paths
+from chunking import chunk_documents, CHUNK_OVERLAP, MAX_TOKENS
+from dedup import MAX_DISTANCE
+from preprocess import preprocess_pages, PROCESSES
+from ann import build_ann
+from index_store import chunk_id, float_vectors, load_index, save_index, shorten_vectors, update_index, QUANTIZATIONS
+from embedding_cache import EmbeddingCache, CACHE_MAX_BYTES
+from embed_scheduler import EmbeddingScheduler, pack_stream, MAX_WORKERS, REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE
 
 # Load environment variables from a .env file
 load_dotenv()
@@ -14,55 +28,244 @@ client = OpenAI(api_key=os.getenv("API_KEY"))
 if not client.api_key:
     raise ValueError("OpenAI API key not found. Make sure API_KEY is set as an environment variable.")
 
-# Tokenizer initialization
-tokenizer = tiktoken.get_encoding("cl100k_base")
-max_tokens = 500
-
-def split_into_many(text, max_tokens=max_tokens):
-    sentences = text.split('. ')
-    n_tokens = [len(tokenizer.encode(" " + sentence)) for sentence in sentences]
-    
-    chunks, chunk = [], []
-    tokens_so_far = 0
-
-    for sentence, token in zip(sentences, n_tokens):
-        if tokens_so_far + token > max_tokens:
-            chunks.append(". ".join(chunk) + ".")
-            chunk = []
-            tokens_so_far = 0
-        if token > max_tokens:
-            continue
-        chunk.append(sentence)
-        tokens_so_far += token + 1
-
-    if chunk:
-        chunks.append(". ".join(chunk) + ".")
-    return chunks
-
-def generate_embeddings():
-    if not os.path.exists('processed/scraped.csv'):
+# Embedding model
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Function to load the previous index if its vectors can be reused for `model` at `dimensions`
+# (None for the model's full width), as they are or shortened; returns None otherwise
+def load_reusable_index(model=EMBEDDING_MODEL, dimensions=None):
+    index = load_index()
+    if index is None or index.model not in (None, model):
+        return None
+    if index.dimensions == dimensions or (dimensions is not None and index.vectors.shape[1] >= dimensions):
+        return index
+    return None
+
+# Function to take the already embedded chunks of the given pages from the previous index;
+# returns their metadata and their rows of the embedding matrix, shortened to `dimensions`
+def load_existing_embeddings(index, filenames, dimensions=None):
+    if index is None or not filenames:
+        return pd.DataFrame(columns=['filename', 'text', 'n_tokens', 'chunk_id']), None
+    mask = index.meta['filename'].isin(filenames).to_numpy()
+    vectors = float_vectors(index, mask)
+    if dimensions is not None and vectors.shape[1] > dimensions:
+        vectors = shorten_vectors(vectors, dimensions)
+    return index.meta[mask].reset_index(drop=True), vectors
+
+# Function to lazily yield (filename, text, status, version) for every crawled page, from the
+# crawler's shards or from a legacy processed/scraped.csv; `version` is the PageVersion the
+# crawler saw (its url is None for the CSV)
+def iter_scraped():
+    if shard_paths():
+        for record in iter_records():
+            version = PageVersion(*(record.get(field) for field in PageVersion._fields))
+            yield record['filename'], record['text'], record.get('status', "new"), version
+    elif os.path.exists('processed/scraped.csv'):
+        df = pd.read_csv('processed/scraped.csv', index_col=0)
+        if 'status' not in df.columns:
+            df['status'] = "new"
+        df['text'] = df['text'].fillna("")
+        for filename, row in df.iterrows():
+            yield filename, row['text'], row['status'], PageVersion(None)
+
+# Function to yield the (filename, text) of every new or changed page. Yielded pages are recorded
+# in `emitted`, pages the crawler found unchanged in `unchanged` and pages it found removed from
+# the site in `gone`, all mapped to their PageVersion
+def iter_pages(unchanged, emitted, gone):
+    for filename, text, status, version in iter_scraped():
+        if status == "unchanged":
+            unchanged[filename] = version
+        elif status == "gone":
+            gone[filename] = version
+        else:
+            emitted[filename] = version
+            yield filename, text
+
+# Function to return the name a page is known by in the index from its URL
+def url_filename(url):
+    return page_filename(urlparse(url).netloc, url)
+
+# Pages the crawler found unchanged keep their previous embeddings; if the previous index does
+# not have them (or cannot be reused), fall back to a page text file saved by an older crawler.
+# Pages in `duplicates` were dropped as near-duplicates and are not expected in the index
+def iter_unindexed_pages(unchanged, index, duplicates=frozenset()):
+    indexed = set(index.meta['filename']) if index is not None else set()
+    for filename in sorted(unchanged.keys() - indexed - duplicates):
+        if os.path.exists(filename):
+            with open(filename) as f:
+                yield filename, remove_newlines(f.read())
+        else:
+            print(f"No embeddings or text found for unchanged page {filename}; re-crawl with --full to include it.")
+
+# Function to give every chunk of a stream of (filename, text, n_tokens) its stable ID and yield
+# (filename, text, n_tokens, chunk_id). Every ID is added to `seen` and every page to `pages`;
+# chunks whose ID is in `indexed` are already embedded and are not yielded
+def identify_chunks(chunks, seen, pages, indexed=frozenset()):
+    page, ordinal = None, 0
+    for filename, text, n_tokens in chunks:
+        ordinal = ordinal + 1 if filename == page else 0
+        page = filename
+        id_ = chunk_id(filename, ordinal, text)
+        seen.add(id_)
+        pages.add(filename)
+        if id_ not in indexed:
+            yield filename, text, n_tokens, id_
+
+# Function to embed a stream of (filename, text, n_tokens, ...) chunks in token-aware batches sent
+# concurrently within the rate limit budgets, asking for `dimensions` dimensions (None for the
+# model's full width); chunks found in `cache` are not sent at all.
+# Yields (chunks, embeddings) per batch in input order. Chunks are pulled lazily, only as
+# fast as the scheduler sends them, so embedding starts while chunking is still running
+def embed_chunks(chunks, model=EMBEDDING_MODEL, requests_per_minute=REQUESTS_PER_MINUTE,
+                 tokens_per_minute=TOKENS_PER_MINUTE, max_workers=MAX_WORKERS, cache=None, dimensions=None):
+    scheduler = EmbeddingScheduler(client, model, requests_per_minute, tokens_per_minute, max_workers,
+                                   dimensions=dimensions)
+    # Vectors of different widths must not share cache entries
+    cache_model = f"{model}:{dimensions}" if dimensions else model
+    # Batches handed to the scheduler, oldest first, with their cached embeddings
+    pending = deque()
+
+    def requests():
+        for batch in pack_stream(chunks, lambda chunk: chunk[2]):
+            texts = [chunk[1] for chunk in batch]
+            embeddings = cache.get_many(cache_model, texts) if cache is not None else [None] * len(texts)
+            misses = [i for i, embedding in enumerate(embeddings) if embedding is None]
+            pending.append((batch, embeddings, misses))
+            # Fully cached batches still go through the scheduler, which returns them at once
+            yield [texts[i] for i in misses], sum(batch[i][2] for i in misses)
+
+    for batch_embeddings in scheduler.map(requests()):
+        batch, embeddings, misses = pending.popleft()
+        for i, embedding in zip(misses, batch_embeddings):
+            embeddings[i] = embedding
+        if cache is not None and misses:
+            cache.put_many(cache_model, [batch[i][1] for i in misses], batch_embeddings)
+        yield batch, embeddings
+
+# Pages are read, deduplicated, chunked and embedded as one lazy pipeline, so only a few
+# batches of pages and chunks are in flight at a time. Near-duplicate pages (paginated
+# listings, print views, ...) within `dedup_distance` SimHash bits of a page already kept are
+# dropped; None disables this. Pages are fingerprinted, encoded and chunked in `processes`
+# worker processes. Chunks hold at most `max_tokens` tokens and repeat the last `overlap`
+# tokens of the chunk before them. Chunks whose text was embedded before are taken from the
+# on-disk cache, capped at `cache_max_bytes`; None disables the cache. `dimensions` asks the
+# model for shorter vectors (None keeps its full width) and `quantization` sets how the
+# matrix is stored; int8 at 512 dimensions takes about 12x less memory than float32 at 1536.
+# Chunks have stable IDs, so a re-crawl only embeds new or changed chunks and the index is
+# updated in place: stale chunks are deleted and new ones appended, nothing else is rewritten
+def generate_embeddings(dedup_distance=MAX_DISTANCE, requests_per_minute=REQUESTS_PER_MINUTE,
+                        tokens_per_minute=TOKENS_PER_MINUTE, max_workers=MAX_WORKERS, cache_max_bytes=CACHE_MAX_BYTES,
+                        max_tokens=MAX_TOKENS, overlap=CHUNK_OVERLAP, processes=PROCESSES, dimensions=None,
+                        quantization="float32"):
+    if not shard_paths() and not os.path.exists('processed/scraped.csv'):
         print("No crawled data found. Please run the crawler first.")
         return
-    
-    df = pd.read_csv('processed/scraped.csv', index_col=0)
-    
-    df['n_tokens'] = df['text'].apply(lambda x: len(tokenizer.encode(x)))
-    shortened = []
-
-    for _, row in df.iterrows():
-        if row['n_tokens'] > max_tokens:
-            shortened += split_into_many(row['text'])
-        else:
-            shortened.append(row['text'])
 
-    df = pd.DataFrame(shortened, columns=['text'])
-    df['n_tokens'] = df.text.apply(lambda x: len(tokenizer.encode(x)))
+    # The index is updated in place when it has the requested model, width and storage;
+    # otherwise it is rebuilt, reusing the vectors of pages that were not re-crawled where it can
+    index = load_reusable_index(EMBEDDING_MODEL, dimensions)
+    incremental = (index is not None and index.dimensions == dimensions
+                   and ("int8" if index.scales is not None else "float32") == quantization)
+    indexed = set(index.meta['chunk_id']) if incremental else frozenset()
+
+    indexed_pages = set(index.meta['filename']) if index is not None else set()
+
+    # New and changed pages are also compared with the pages already indexed. Pages dropped as
+    # their near-duplicates by earlier runs are recorded with the page they duplicate
+    state = CrawlState()
+    urls, known = {}, {}
+    for url, fingerprint in state.fingerprints().items():
+        if url_filename(url) in indexed_pages:
+            urls[url_filename(url)], known[url_filename(url)] = url, fingerprint
+    recorded = {url_filename(url): url_filename(twin) for url, twin in state.duplicates().items()}
+    state.close()
+
+    unchanged, emitted, gone, seen, chunked = {}, {}, {}, set(), set()
+    fingerprints, duplicate_of = {}, {}
+    chunks = chain(preprocess_pages(iter_pages(unchanged, emitted, gone), dedup_distance, max_tokens, overlap, processes,
+                                    known=known, fingerprints=fingerprints, duplicate_of=duplicate_of),
+                   chunk_documents(iter_unindexed_pages(unchanged, index, recorded.keys()), max_tokens, overlap))
+
+    rows, vectors = [], []
+    cache = EmbeddingCache(max_bytes=cache_max_bytes) if cache_max_bytes is not None else None
+    try:
+        for batch, embeddings in embed_chunks(identify_chunks(chunks, seen, chunked, indexed), EMBEDDING_MODEL,
+                                              requests_per_minute, tokens_per_minute, max_workers, cache, dimensions):
+            rows += batch
+            vectors.append(np.asarray(embeddings, dtype=np.float32))
+    finally:
+        if cache is not None:
+            cache.close()
+            print(cache.summary())
+    vectors = np.concatenate(vectors) if vectors else np.empty((0, 0), dtype=np.float32)
+    df = pd.DataFrame(rows, columns=['filename', 'text', 'n_tokens', 'chunk_id'])
+
+    # Pages missing from this crawl (a fetch error, the crawl limit) keep their chunks. Only the
+    # chunks of pages the crawler found removed, and chunks of re-crawled pages this run did not
+    # produce again (the page changed or is now a near-duplicate), are stale
+    if incremental:
+        meta = index.meta
+        stale = meta['chunk_id'][meta['filename'].isin(gone.keys())
+                                 | (meta['filename'].isin(emitted.keys()) & ~meta['chunk_id'].isin(seen))]
+        update_index(df, vectors, stale)
+        print(f"Index updated ({len(df)} chunks embedded, {len(index.meta) - len(stale)} kept, "
+              f"{len(stale)} deleted).")
+    else:
+        kept, kept_vectors = load_existing_embeddings(index, indexed_pages - emitted.keys() - gone.keys(), dimensions)
+        if len(kept):
+            vectors = np.concatenate([kept_vectors, vectors]) if len(vectors) else kept_vectors
+        df = pd.concat([kept, df], ignore_index=True)
+        save_index(df, vectors, EMBEDDING_MODEL, quantization=quantization, dimensions=dimensions)
+        print(f"Embeddings generated and saved ({len(rows)} chunks embedded, {len(kept)} reused).")
+
+    def in_index(filename):
+        return filename in chunked or (filename in indexed_pages and filename not in emitted and filename not in gone)
+
+    # A near-duplicate dropped by this run, or by an earlier one and unchanged since, stays
+    # dropped while the page it duplicates is indexed and was not re-crawled after it was
+    # compared with it; otherwise it is fetched and compared again next time
+    twins = {filename: twin for filename, twin in recorded.items() if filename in unchanged}
+    twins.update(duplicate_of)
+    kept_duplicates = {filename: twin for filename, twin in twins.items()
+                       if twin is not None and in_index(twin) and (filename in duplicate_of or twin not in emitted)}
+    urls.update((filename, version.url) for filename, version in emitted.items())
+
+    # Only now that the index is saved does the crawl state record the versions of the pages in
+    # it (and of their near-duplicates) and forget the removed pages. A page left without chunks
+    # must be fetched in full next time: answered with 304, it would be "unchanged" with no text
+    # to embed it from
+    pages = list(chain(emitted.items(), unchanged.items()))
+    in_state = [version for filename, version in pages if in_index(filename) or filename in kept_duplicates]
+    empty = [version.url for filename, version in pages if not in_index(filename) and filename not in kept_duplicates]
+    new_fingerprints = [(version.url, fingerprints.get(filename), urls.get(kept_duplicates.get(filename)))
+                        for filename, version in emitted.items() if in_index(filename) or filename in kept_duplicates]
+    state = CrawlState()
+    state.mark_indexed(version for version in in_state if version.url is not None)
+    state.set_fingerprints(row for row in new_fingerprints if row[0] is not None)
+    state.forget(version.url for version in gone.values() if version.url is not None)
+    state.clear_validators(url for url in empty if url is not None)
+    state.close()
 
-    # Apply embedding
-    df['embeddings'] = df.text.apply(lambda x: client.embeddings.create(input=x, model="text-embedding-3-small").data[0].embedding)
-    
-    df.to_csv('processed/embeddings.csv')
-    print("Embeddings generated and saved.")
+    # Large indexes also get inverted lists for approximate search
+    build_ann()
 
 if __name__ == "__main__":
-    generate_embeddings()
+    parser = argparse.ArgumentParser(description="Generate embeddings for the crawled pages.")
+    parser.add_argument("--dedup-distance", type=int, default=MAX_DISTANCE,
+                        help="max SimHash Hamming distance between near-duplicate pages (-1 disables)")
+    parser.add_argument("--rpm", type=int, default=REQUESTS_PER_MINUTE, help="embedding requests-per-minute budget")
+    parser.add_argument("--tpm", type=int, default=TOKENS_PER_MINUTE, help="embedding tokens-per-minute budget")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="concurrent embedding requests")
+    parser.add_argument("--cache-max-mb", type=int, default=CACHE_MAX_BYTES // (1024 * 1024),
+                        help="size cap of the on-disk embedding cache in MiB (-1 disables the cache)")
+    parser.add_argument("--max-tokens", type=int, default=MAX_TOKENS, help="max tokens per chunk")
+    parser.add_argument("--overlap", type=int, default=CHUNK_OVERLAP, help="tokens repeated from the previous chunk")
+    parser.add_argument("--processes", type=int, default=PROCESSES,
+                        help="worker processes that fingerprint, encode and chunk pages")
+    parser.add_argument("--dimensions", type=int, help="ask the model for shorter vectors (default: full width)")
+    parser.add_argument("--quantize", choices=QUANTIZATIONS, default="float32",
+                        help="store the embedding matrix as float32 or as int8 with a scale per row")
+    args = parser.parse_args()
+    generate_embeddings(args.dedup_distance if args.dedup_distance >= 0 else None, args.rpm, args.tpm, args.workers,
+                        args.cache_max_mb * 1024 * 1024 if args.cache_max_mb >= 0 else None,
+                        args.max_tokens, args.overlap, args.processes, args.dimensions, args.quantize)
@@ -0,0 +1,94 @@
+import hashlib
+import os
+import sqlite3
+import time
+import numpy as np
+
+# Default location and size cap of the on-disk embedding cache
+CACHE_PATH = "processed/embedding_cache.db"
+CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# SQLite limits the number of parameters per statement
+QUERY_CHUNK = 500
+
+def cache_key(model, text):
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).digest()
+
+# Content-addressed embedding cache keyed by (model, text hash). Vectors are stored as raw
+# float32 bytes with the time they were stored; once the cache grows past `max_bytes`, the least
+# recently used vectors are evicted
+class EmbeddingCache:
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_bytes = max_bytes
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS vectors (key BLOB PRIMARY KEY, model TEXT, vector BLOB, last_used REAL, created REAL)"
+        )
+        # Caches written before entries had a creation time take their last use instead
+        if "created" not in {row[1] for row in self.conn.execute("PRAGMA table_info(vectors)")}:
+            self.conn.execute("ALTER TABLE vectors ADD COLUMN created REAL")
+            self.conn.execute("UPDATE vectors SET created = last_used")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS vectors_last_used ON vectors (last_used)")
+        self.conn.commit()
+        self.hits = self.misses = self.evicted = 0
+
+    # Function to look up many texts at once; returns a vector or None for every text. Vectors
+    # stored more than `max_age` seconds ago count as missing. With `touch`, the vectors found are
+    # marked as used now, which keeps them from eviction but costs a write. A `created` list
+    # receives the time each vector was stored (None for a miss)
+    def get_many(self, model, texts, max_age=None, touch=True, created=None):
+        keys = [cache_key(model, text) for text in texts]
+        oldest = time.time() - max_age if max_age is not None else float("-inf")
+        found = {}
+        for start in range(0, len(keys), QUERY_CHUNK):
+            chunk = keys[start:start + QUERY_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT key, vector, created FROM vectors WHERE key IN ({placeholders}) AND created >= ?", [*chunk, oldest]
+            )
+            found.update((key, (vector, stored)) for key, vector, stored in rows)
+            if touch:
+                self.conn.execute(f"UPDATE vectors SET last_used = ? WHERE key IN ({placeholders})", [time.time(), *chunk])
+        if touch:
+            self.conn.commit()
+
+        vectors = [np.frombuffer(found[key][0], dtype=np.float32) if key in found else None for key in keys]
+        if created is not None:
+            created.extend(found[key][1] if key in found else None for key in keys)
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return vectors
+
+    def put_many(self, model, texts, vectors):
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO vectors (key, model, vector, last_used, created) VALUES (?, ?, ?, ?, ?)",
+            ((cache_key(model, text), model, np.asarray(vector, dtype=np.float32).tobytes(), now, now)
+             for text, vector in zip(texts, vectors)),
+        )
+        self.conn.commit()
+
+    # Function to drop the least recently used vectors until the cache fits in `max_bytes`
+    def evict(self):
+        count, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM vectors").fetchone()
+        if size <= self.max_bytes:
+            return
+        n_evict = count - int(self.max_bytes / (size / count))
+        self.conn.execute(
+            "DELETE FROM vectors WHERE key IN (SELECT key FROM vectors ORDER BY last_used LIMIT ?)", (n_evict,)
+        )
+        self.conn.commit()
+        self.evicted += n_evict
+
+    def summary(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total * 100 if total else 0.0
+        return (f"Embedding cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), "
+                f"{self.evicted} evicted")
+
+    def close(self):
+        self.evict()
+        self.conn.close()
@@ -0,0 +1,75 @@
+import re
+from bs4 import BeautifulSoup
+
+# Use the fast lxml parser when it is installed, Python's built-in parser otherwise
+try:
+    import lxml  # noqa: F401
+    DEFAULT_PARSER = "lxml"
+except ImportError:
+    DEFAULT_PARSER = "html.parser"
+
+# Tags that are never shown as text, and tags of page chrome that never hold the main content
+INVISIBLE_TAGS = ["script", "style", "noscript", "template", "svg", "iframe"]
+BOILERPLATE_TAGS = ["nav", "header", "footer", "aside", "form", "button"]
+
+# Names of navigation bars, cookie banners, share widgets and similar chrome, and words they
+# are commonly combined with ("cookie-banner", "site-footer", "share-buttons", ...)
+BOILERPLATE_NAMES = (r"cookies?|consent|gdpr|banner|breadcrumbs?|navbar|menu|sidebar|footer|masthead|share|sharing|"
+                     r"social|popup|modal|newsletter|subscribe|advert|ads")
+BOILERPLATE_AFFIXES = (r"site|main|top|bottom|left|right|global|primary|secondary|page|mobile|nav|bar|box|links|"
+                       r"buttons|icons|widget|container|wrapper|notice|dialog|overlay|area|section|list|inner|outer")
+
+# An id or class token is chrome only as a whole: "sidebar" and "cookie-banner" match, but not
+# "has-sidebar", "no-modal" or "social-sciences"
+BOILERPLATE_PATTERN = re.compile(
+    rf"^(?:(?:{BOILERPLATE_AFFIXES})[-_])*(?:{BOILERPLATE_NAMES})(?:[-_](?:{BOILERPLATE_NAMES}|{BOILERPLATE_AFFIXES}))*$",
+    re.IGNORECASE,
+)
+
+# An element holding more than this share of the page text is never dropped as chrome, and
+# main content shorter than this share of the page text is ignored in favour of the whole page
+MAX_BOILERPLATE_SHARE = 0.5
+MIN_MAIN_SHARE = 0.05
+
+# Containers that usually wrap the main content, most specific first
+MAIN_SELECTORS = ["main", "article", "[role=main]", "#content", "#main-content", ".main-content"]
+
+def parse_html(html, parser=DEFAULT_PARSER):
+    return BeautifulSoup(html, parser)
+
+def visible_text(tag):
+    lines = (line.strip() for line in tag.get_text("\n").splitlines())
+    return "\n".join(line for line in lines if line)
+
+def is_boilerplate(tag):
+    if tag.name in ("html", "body", "main", "article") or tag.attrs is None:
+        return False
+    names = [tag.get("id") or ""] + (tag.get("class") or [])
+    return (any(BOILERPLATE_PATTERN.match(name) for name in names if name)
+            and tag.find(["main", "article"]) is None)
+
+# Function to strip page chrome (scripts, navigation, headers, footers, cookie banners, ...)
+# from a parsed page in place and return the text of its main content. When that would leave
+# little of the page, e.g. because the whole page sits in a wrapper named like chrome, the text
+# of the whole page is returned instead
+def extract_main_text(soup):
+    for tag in soup.find_all(INVISIBLE_TAGS):
+        if not tag.decomposed:
+            tag.decompose()
+    root = soup.body or soup
+    full_text = visible_text(root)
+    max_length = MAX_BOILERPLATE_SHARE * len(full_text)
+
+    for tag in soup.find_all(lambda tag: tag.name in BOILERPLATE_TAGS or is_boilerplate(tag)):
+        if not tag.decomposed and len(visible_text(tag)) <= max_length:
+            tag.decompose()
+
+    text = visible_text(root)
+    for selector in MAIN_SELECTORS:
+        main = soup.select_one(selector)
+        if main is not None and visible_text(main):
+            text = visible_text(main)
+            break
+    if len(text) < MIN_MAIN_SHARE * len(full_text):
+        return full_text
+    return text
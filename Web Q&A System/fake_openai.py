@@ -0,0 +1,193 @@
+import argparse
+import base64
+import hashlib
+import json
+import multiprocessing
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import tiktoken
+
+# Fake OpenAI-compatible endpoint for offline tests and benchmarks. It answers
+# POST /v1/embeddings with deterministic unit vectors derived from each input text and
+# POST /v1/chat/completions with a deterministic answer (streamed token by token over
+# server-sent events when asked to), enforces requests-per-minute and tokens-per-minute limits with 429 + Retry-After like the
+# real API, and runs in its own process. Point a client at it with base_url=<url>/v1
+# (or OPENAI_BASE_URL) and any API key
+
+DIMENSIONS = 1536
+
+# Seconds between two streamed answer tokens, and length of a fake answer in tokens
+TOKEN_LATENCY = 0.01
+ANSWER_TOKENS = 40
+
+ANSWER_WORDS = ("the answer depends on the context given with the question and the pages "
+                "crawled from the website which describe this topic in more detail").split()
+
+def fake_answer(prompt, max_tokens=None):
+    seed = int.from_bytes(hashlib.sha256(prompt.encode("utf-8")).digest()[:8], "little")
+    rng = np.random.default_rng(seed)
+    n_words = min(ANSWER_TOKENS, max_tokens or ANSWER_TOKENS)
+    return [("" if i == 0 else " ") + ANSWER_WORDS[j] for i, j in enumerate(rng.integers(len(ANSWER_WORDS), size=n_words))]
+
+def fake_embedding(text, dimensions=DIMENSIONS):
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+def make_handler(requests_per_minute, tokens_per_minute, latency):
+    tokenizer = tiktoken.get_encoding("cl100k_base")
+    stats = {"requests": 0, "rate_limited": 0, "inputs": 0, "tokens": 0}
+    # One second worth of budget, refilled continuously
+    bucket = {"requests": requests_per_minute / 60, "tokens": tokens_per_minute / 60, "updated": time.monotonic()}
+    lock = threading.Lock()
+
+    def admit(n_tokens):
+        with lock:
+            now = time.monotonic()
+            elapsed = now - bucket["updated"]
+            bucket["updated"] = now
+            bucket["requests"] = min(requests_per_minute / 60, bucket["requests"] + elapsed * requests_per_minute / 60)
+            bucket["tokens"] = min(tokens_per_minute / 60, bucket["tokens"] + elapsed * tokens_per_minute / 60)
+            if bucket["requests"] < 1 or bucket["tokens"] < min(n_tokens, tokens_per_minute / 60):
+                stats["rate_limited"] += 1
+                wait = max((1 - bucket["requests"]) * 60 / requests_per_minute,
+                           (n_tokens - bucket["tokens"]) * 60 / tokens_per_minute)
+                return max(wait, 0.05)
+            bucket["requests"] -= 1
+            bucket["tokens"] -= n_tokens
+            stats["requests"] += 1
+            return None
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def send_json(self, status, payload, headers=()):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            for key, value in headers:
+                self.send_header(key, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_chunk(self, data):
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def chat_completion(self, request):
+            prompt = "\n".join(str(message.get("content", "")) for message in request.get("messages", []))
+            n_tokens = len(tokenizer.encode(prompt, disallowed_special=()))
+            wait = admit(n_tokens)
+            if wait is not None:
+                self.send_json(429, {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                               [("retry-after", f"{wait:.3f}")])
+                return
+            with lock:
+                stats["tokens"] += n_tokens
+
+            time.sleep(latency)
+            words = fake_answer(prompt, request.get("max_tokens"))
+            completion = {"id": "chatcmpl-fake", "created": int(time.time()), "model": request.get("model")}
+            if not request.get("stream"):
+                self.send_json(200, dict(completion, object="chat.completion", choices=[
+                    {"index": 0, "message": {"role": "assistant", "content": "".join(words)}, "finish_reason": "stop"}
+                ], usage={"prompt_tokens": n_tokens, "completion_tokens": len(words), "total_tokens": n_tokens + len(words)}))
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            deltas = [{"role": "assistant", "content": ""}] + [{"content": word} for word in words] + [{}]
+            for i, delta in enumerate(deltas):
+                if 1 < i < len(deltas) - 1:
+                    time.sleep(TOKEN_LATENCY)
+                choice = {"index": 0, "delta": delta, "finish_reason": "stop" if i == len(deltas) - 1 else None}
+                chunk = dict(completion, object="chat.completion.chunk", choices=[choice])
+                self.send_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.send_chunk(b"data: [DONE]\n\n")
+            self.send_chunk(b"")
+
+        def do_GET(self):
+            if self.path == "/__stats":
+                with lock:
+                    self.send_json(200, dict(stats))
+            else:
+                self.send_json(404, {"error": {"message": "Not found"}})
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if self.path.rstrip("/") in ("/v1/chat/completions", "/chat/completions"):
+                self.chat_completion(request)
+                return
+            if self.path.rstrip("/") not in ("/v1/embeddings", "/embeddings"):
+                self.send_json(404, {"error": {"message": "Not found"}})
+                return
+
+            inputs = request.get("input", [])
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            n_tokens = sum(len(tokenizer.encode(text, disallowed_special=())) for text in inputs)
+            wait = admit(n_tokens)
+            if wait is not None:
+                self.send_json(429, {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                               [("retry-after", f"{wait:.3f}")])
+                return
+
+            time.sleep(latency)
+            dimensions = request.get("dimensions") or DIMENSIONS
+            data = []
+            for i, text in enumerate(inputs):
+                vector = fake_embedding(text, dimensions)
+                if request.get("encoding_format") == "base64":
+                    embedding = base64.b64encode(vector.astype("<f4").tobytes()).decode()
+                else:
+                    embedding = vector.tolist()
+                data.append({"object": "embedding", "index": i, "embedding": embedding})
+            with lock:
+                stats["inputs"] += len(inputs)
+                stats["tokens"] += n_tokens
+            self.send_json(200, {"object": "list", "data": data, "model": request.get("model"),
+                                 "usage": {"prompt_tokens": n_tokens, "total_tokens": n_tokens}})
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+def serve(port_queue, requests_per_minute, tokens_per_minute, latency):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(requests_per_minute, tokens_per_minute, latency))
+    server.daemon_threads = True
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+# Function to start the fake endpoint in a child process; returns the process and its root URL
+def start_fake_openai(requests_per_minute=3000, tokens_per_minute=1000000, latency=0.05):
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=serve, args=(port_queue, requests_per_minute, tokens_per_minute, latency), daemon=True
+    )
+    process.start()
+    return process, f"http://127.0.0.1:{port_queue.get()}"
+
+def fake_stats(base_url):
+    with urllib.request.urlopen(f"{base_url}/__stats") as response:
+        return json.loads(response.read())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a fake OpenAI-compatible API for offline runs.")
+    parser.add_argument("--rpm", type=int, default=3000, help="requests-per-minute limit")
+    parser.add_argument("--tpm", type=int, default=1000000, help="tokens-per-minute limit")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every successful request")
+    args = parser.parse_args()
+
+    process, base_url = start_fake_openai(args.rpm, args.tpm, args.latency)
+    print(f"Fake OpenAI API at {base_url}/v1 (run with OPENAI_BASE_URL={base_url}/v1; Ctrl+C to stop)")
+    try:
+        process.join()
+    except KeyboardInterrupt:
+        process.terminate()
@@ -0,0 +1,337 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+import uuid
+from ast import literal_eval
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+
+# Default locations of the binary index and of the legacy CSV index
+INDEX_DIR = "processed/index"
+LEGACY_CSV = "processed/embeddings.csv"
+MANIFEST = "manifest.json"
+
+# Ways to store the embedding matrix: full float32, or int8 with one float32 scale per row
+# (about 4x smaller at the same width)
+QUANTIZATIONS = ("float32", "int8")
+
+# Updates append a segment and tombstone replaced rows; the index is compacted back into one
+# segment once it has more than MAX_SEGMENTS segments or COMPACT_RATIO of its rows are deleted
+MAX_SEGMENTS = 8
+COMPACT_RATIO = 0.25
+
+# A loaded index: chunk metadata (filename, text, n_tokens, chunk_id), the embedding matrix
+# (memory-mapped, one row per chunk, float32 or int8; a SegmentedVectors when the rows span
+# several segments or some are deleted), the version that identifies this build
+# of the index, the per-row scales of an int8 matrix (None for float32), the embedding model,
+# the reduced dimensions it was asked for (None for the model's full width) and the inverted
+# lists of the approximate nearest-neighbour index (None when there is none)
+StoredIndex = namedtuple("StoredIndex", ["meta", "vectors", "version", "scales", "model", "dimensions", "ann"],
+                         defaults=(None, None, None, None))
+
+# Inverted lists: unit centroids, the rows sorted by nearest centroid, and where each
+# centroid's rows start in that order (one more offset than centroids)
+AnnLists = namedtuple("AnnLists", ["centroids", "order", "offsets"])
+
+# Function to read the manifest; an index written as a single set of files, before the index
+# was split into segments, is read as one segment
+def read_manifest(directory=INDEX_DIR):
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        manifest = json.load(f)
+    if "segments" not in manifest:
+        segment = {key: manifest.pop(key, None) for key in ("vectors", "meta", "scales")}
+        manifest["segments"] = [dict(segment, id=manifest["version"], deleted=None, rows=manifest["rows"])]
+    return manifest
+
+# Function to quantize every row to int8 with its own scale, so that row ~= int8 row * scale
+def quantize_int8(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scales = np.abs(vectors).max(axis=1) / 127 if vectors.size else np.ones(len(vectors), dtype=np.float32)
+    scales[scales == 0] = 1
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+# Function to cut vectors down to their first `dimensions` dimensions and renormalize them,
+# which is what the API returns for text-embedding-3 models when asked for fewer dimensions
+def shorten_vectors(vectors, dimensions):
+    vectors = vectors[:, :dimensions]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+# Function to return the given rows of the index as float32 vectors, undoing any quantization
+def float_vectors(index, rows=slice(None)):
+    vectors = np.array(index.vectors[rows], dtype=np.float32)
+    if index.scales is not None:
+        vectors *= index.scales[rows][:, None]
+    return vectors
+
+# The rows of an index whose matrix is split over several segments or has deleted rows. Every
+# segment stays memory-mapped; `live` holds the positions of its live rows (None when none
+# are deleted), and indexing reads only the requested rows and gathers them into a new array
+class SegmentedVectors:
+    def __init__(self, segments, live):
+        self.segments = segments
+        self.live = live
+        counts = [len(rows) if rows is not None else len(segment) for segment, rows in zip(segments, live)]
+        self.starts = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self.shape = (int(self.starts[-1]),) + segments[0].shape[1:]
+        self.dtype = segments[0].dtype
+        self.ndim = len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, rows):
+        if isinstance(rows, slice):
+            positions = np.arange(*rows.indices(len(self)))
+        else:
+            positions = np.asarray(rows)
+            if positions.dtype == bool:
+                positions = np.flatnonzero(positions)
+            positions = np.where(positions < 0, positions + len(self), positions)
+        gathered = np.empty((len(positions),) + self.shape[1:], dtype=self.dtype)
+        owners = np.searchsorted(self.starts, positions, side="right") - 1
+        for owner in np.unique(owners):
+            mine = owners == owner
+            local = positions[mine] - self.starts[owner]
+            if self.live[owner] is not None:
+                local = self.live[owner][local]
+            gathered[mine] = self.segments[owner][local]
+        return gathered
+
+    def __array__(self, dtype=None, copy=None):
+        rows = self[:]
+        return rows if dtype is None else rows.astype(dtype, copy=False)
+
+# Function to return the stable ID of a chunk: its page, its position on the page and a
+# hash of its text, so an unchanged chunk keeps its ID across crawls and a changed one does not
+def chunk_id(page, ordinal, text):
+    return f"{page}#{ordinal}#{hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]}"
+
+# Function to compute the chunk IDs of an index built before chunks had IDs
+def chunk_ids(meta):
+    ordinals = meta.groupby('filename', sort=False).cumcount()
+    return [chunk_id(page, ordinal, text) for page, ordinal, text in zip(meta['filename'], ordinals, meta['text'])]
+
+# Function to write the data files of one segment: its metadata, its (possibly quantized)
+# vectors and its per-row scales; returns the segment's manifest entry
+def write_segment(directory, meta, vectors, quantization):
+    segment_id = f"{int(time.time())}-{uuid.uuid4().hex[:8]}"
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    segment = {
+        "id": segment_id,
+        "vectors": f"embeddings-{segment_id}.npy",
+        "meta": f"meta-{segment_id}.parquet",
+        "scales": None,
+        "deleted": None,
+        "rows": len(meta),
+    }
+    if quantization == "int8" and vectors.ndim == 2:
+        vectors, scales = quantize_int8(vectors)
+        segment["scales"] = f"scales-{segment_id}.npy"
+        np.save(os.path.join(directory, segment["scales"]), scales)
+    np.save(os.path.join(directory, segment["vectors"]), vectors)
+    meta = meta.reset_index(drop=True)
+    if 'chunk_id' not in meta.columns:
+        meta['chunk_id'] = chunk_ids(meta)
+    meta[['filename', 'text', 'n_tokens', 'chunk_id']].to_parquet(os.path.join(directory, segment["meta"]), index=False)
+    return segment
+
+def _segment_ids(directory, segment):
+    path = os.path.join(directory, segment["meta"])
+    try:
+        return pd.read_parquet(path, columns=['chunk_id'])['chunk_id']
+    except ValueError:
+        # Segment written before chunks had IDs
+        return pd.Series(chunk_ids(pd.read_parquet(path)))
+
+def _files(manifest):
+    if manifest is None:
+        return set()
+    ann = manifest.get("ann") or {}
+    return ({segment[key] for segment in manifest["segments"] for key in ("vectors", "meta", "scales", "deleted")
+             if segment.get(key)} | {ann[key] for key in ("centroids", "lists") if ann.get(key)})
+
+# Function to swap in a new manifest atomically, then delete the files only the old one used.
+# Readers that already mapped the old files keep them open until they let go
+def _commit(directory, manifest, previous):
+    manifest["rows"] = sum(segment["rows"] - segment.get("n_deleted", 0) for segment in manifest["segments"])
+    tmp_path = os.path.join(directory, MANIFEST + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, os.path.join(directory, MANIFEST))
+    for name in _files(previous) - _files(manifest):
+        if os.path.exists(os.path.join(directory, name)):
+            os.remove(os.path.join(directory, name))
+    return manifest["version"]
+
+# Function to write a new version of the index from scratch, as a single segment. Data files
+# get unique names and the manifest naming them is swapped in last, so readers never see a
+# half-written index
+def save_index(meta, vectors, model=None, directory=INDEX_DIR, quantization="float32", dimensions=None):
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization '{quantization}'; expected one of {', '.join(QUANTIZATIONS)}")
+    os.makedirs(directory, exist_ok=True)
+    previous = read_manifest(directory)
+    segment = write_segment(directory, meta, vectors, quantization)
+    manifest = {
+        "version": segment["id"],
+        "segments": [segment],
+        "dims": int(vectors.shape[1]) if np.ndim(vectors) == 2 else 0,
+        "model": model,
+        "dimensions": dimensions,
+        "quantization": quantization,
+    }
+    return _commit(directory, manifest, previous)
+
+# Function to update the index in place: chunks whose ID is in `deleted_ids` are tombstoned,
+# and `meta`/`vectors` (which must have a chunk_id column) are appended as a new segment,
+# replacing any chunks with the same IDs. Existing segments are never rewritten, until there
+# are more than `max_segments` of them or `compact_ratio` of their rows are deleted; then the
+# whole index is compacted into one segment
+def update_index(meta, vectors, deleted_ids=(), directory=INDEX_DIR, max_segments=MAX_SEGMENTS,
+                 compact_ratio=COMPACT_RATIO):
+    previous = read_manifest(directory)
+    if previous is None:
+        raise ValueError(f"No index to update in '{directory}'")
+    manifest = dict(previous, segments=[dict(segment) for segment in previous["segments"]])
+    if manifest.get("ann"):
+        # Row positions change, so the inverted lists must be rebuilt; the centroids still fit
+        manifest["ann"] = dict(manifest["ann"], lists=None)
+    replaced = set(deleted_ids) | set(meta['chunk_id'])
+
+    segments = []
+    for segment in manifest["segments"]:
+        ids = _segment_ids(directory, segment)
+        deleted = set(np.load(os.path.join(directory, segment["deleted"])).tolist()) if segment.get("deleted") else set()
+        newly_deleted = set(np.flatnonzero(ids.isin(replaced).to_numpy()).tolist()) - deleted
+        if len(deleted) + len(newly_deleted) >= segment["rows"]:
+            # Nothing left in the segment; its files go with the old manifest
+            continue
+        if newly_deleted:
+            deleted |= newly_deleted
+            segment["deleted"] = f"deleted-{segment['id']}-{uuid.uuid4().hex[:8]}.npy"
+            segment["n_deleted"] = len(deleted)
+            np.save(os.path.join(directory, segment["deleted"]), np.array(sorted(deleted), dtype=np.int64))
+        segments.append(segment)
+    if len(meta):
+        segments.append(write_segment(directory, meta, vectors, manifest.get("quantization", "float32")))
+        if not manifest.get("dims"):
+            manifest["dims"] = int(np.shape(vectors)[1])
+    manifest["segments"] = segments
+    manifest["version"] = f"{int(time.time())}-{uuid.uuid4().hex[:8]}"
+    version = _commit(directory, manifest, previous)
+
+    n_rows = sum(segment["rows"] for segment in manifest["segments"])
+    n_deleted = sum(segment.get("n_deleted", 0) for segment in manifest["segments"])
+    if len(manifest["segments"]) > max_segments or (n_rows and n_deleted / n_rows > compact_ratio):
+        version = compact_index(directory)
+    return version
+
+# Function to commit a new version of the manifest with the given entries changed, e.g. to
+# attach the approximate nearest-neighbour index built for the current rows
+def update_manifest(directory=INDEX_DIR, **changes):
+    previous = read_manifest(directory)
+    manifest = dict(previous, **changes, version=f"{int(time.time())}-{uuid.uuid4().hex[:8]}")
+    return _commit(directory, manifest, previous)
+
+# Function to rewrite the index as a single segment without deleted rows
+def compact_index(directory=INDEX_DIR):
+    index = load_index(directory)
+    return save_index(index.meta, float_vectors(index), index.model, directory,
+                      "int8" if index.scales is not None else "float32", index.dimensions)
+
+# Function to read an index in the old processed/embeddings.csv format
+def read_legacy_csv(path=LEGACY_CSV):
+    df = pd.read_csv(path, index_col=0)
+    if 'filename' not in df.columns:
+        df['filename'] = ""
+    vectors = np.array([literal_eval(embedding) for embedding in df['embeddings']], dtype=np.float32)
+    return df[['filename', 'text', 'n_tokens']].reset_index(drop=True), vectors
+
+# Function to convert an old processed/embeddings.csv into the binary index
+def import_csv(path=LEGACY_CSV, directory=INDEX_DIR, quantization="float32"):
+    meta, vectors = read_legacy_csv(path)
+    return save_index(meta, vectors, directory=directory, quantization=quantization)
+
+# Function to load the index near-instantly: the matrix is memory-mapped, not parsed. Segments
+# and deleted rows are never gathered into one matrix; only the small metadata and per-row
+# scales are. An old CSV index is converted to the binary format the first time it is loaded
+def load_index(directory=INDEX_DIR, legacy_csv=LEGACY_CSV):
+    manifest = read_manifest(directory)
+    if manifest is None:
+        if not os.path.exists(legacy_csv):
+            return None
+        print(f"Converting '{legacy_csv}' to the binary index in '{directory}'.")
+        import_csv(legacy_csv, directory)
+        manifest = read_manifest(directory)
+
+    metas, vectors, lives, scales = [], [], [], []
+    for segment in manifest["segments"]:
+        meta = pd.read_parquet(os.path.join(directory, segment["meta"]))
+        if 'chunk_id' not in meta.columns:
+            meta['chunk_id'] = chunk_ids(meta)
+        segment_scales = np.load(os.path.join(directory, segment["scales"])) if segment.get("scales") else None
+        live = None
+        if segment.get("deleted"):
+            mask = np.ones(len(meta), dtype=bool)
+            mask[np.load(os.path.join(directory, segment["deleted"]))] = False
+            live = np.flatnonzero(mask)
+            meta = meta[mask]
+            segment_scales = segment_scales[mask] if segment_scales is not None else None
+        metas.append(meta)
+        vectors.append(np.load(os.path.join(directory, segment["vectors"]), mmap_mode="r"))
+        lives.append(live)
+        scales.append(segment_scales)
+
+    if not vectors:
+        # Every chunk was deleted: an empty index, which the next update appends to
+        int8 = manifest.get("quantization") == "int8"
+        meta = pd.DataFrame(columns=['filename', 'text', 'n_tokens', 'chunk_id'])
+        vectors = np.empty((0, manifest.get("dims", 0)), dtype=np.int8 if int8 else np.float32)
+        scales = np.empty(0, dtype=np.float32) if int8 else None
+    elif len(vectors) == 1 and lives[0] is None:
+        meta, vectors, scales = metas[0].reset_index(drop=True), vectors[0], scales[0]
+    else:
+        meta = pd.concat(metas, ignore_index=True)
+        vectors = SegmentedVectors(vectors, lives)
+        scales = np.concatenate(scales) if scales[0] is not None else None
+
+    ann = manifest.get("ann") or {}
+    lists = None
+    if ann.get("lists"):
+        with np.load(os.path.join(directory, ann["lists"])) as data:
+            lists = AnnLists(np.load(os.path.join(directory, ann["centroids"])), data["order"], data["offsets"])
+    return StoredIndex(meta, vectors, manifest["version"], scales, manifest.get("model"), manifest.get("dimensions"),
+                       lists)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the binary embedding index.")
+    parser.add_argument("--import-csv", metavar="PATH", nargs="?", const=LEGACY_CSV,
+                        help="convert an embeddings.csv file into the binary index")
+    parser.add_argument("--quantize", choices=QUANTIZATIONS,
+                        help="store the matrix as float32 or int8; on its own, rewrites the current index")
+    parser.add_argument("--compact", action="store_true", help="merge the segments and drop deleted rows")
+    args = parser.parse_args()
+    if args.compact:
+        print(f"Compacted the index (version {compact_index()}).")
+    elif args.import_csv:
+        version = import_csv(args.import_csv, quantization=args.quantize or "float32")
+        print(f"Imported '{args.import_csv}' as index version {version}.")
+    elif args.quantize:
+        index = load_index()
+        if index is None:
+            print("No index found.")
+        else:
+            version = save_index(index.meta, float_vectors(index), index.model, quantization=args.quantize,
+                                 dimensions=index.dimensions)
+            print(f"Stored the index as {args.quantize} (version {version}).")
+    else:
+        manifest = read_manifest()
+        print(json.dumps(manifest, indent=2) if manifest else "No index found.")
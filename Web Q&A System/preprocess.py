@@ -0,0 +1,102 @@
+import multiprocessing
+import os
+from collections import deque
+from itertools import chain, islice
+from chunking import chunk_tokens, token_byte_lengths, tokenizer, CHUNK_OVERLAP, MAX_TOKENS
+from dedup import NearDuplicateIndex, simhash, MAX_DISTANCE
+
+# Preprocessing settings: worker processes and the number of pages sent to a worker at a time
+PROCESSES = os.cpu_count() or 1
+PAGES_PER_TASK = 64
+
+# Below this many pages, starting worker processes (about 2s) costs more than they save, so the
+# pages are preprocessed in the calling process
+POOL_MIN_PAGES = 1000
+
+# Function run in a worker: fingerprint (unless `shingle_size` is None), encode and chunk a
+# batch of (filename, text) pages; returns (filename, fingerprint, n_tokens, chunks) per page
+def preprocess_batch(batch, max_tokens=MAX_TOKENS, overlap=CHUNK_OVERLAP, shingle_size=None):
+    encoded = tokenizer.encode_ordinary_batch([text for _, text in batch], num_threads=1)
+    return [
+        (filename, simhash(text, shingle_size) if shingle_size is not None else None, len(tokens),
+         list(chunk_tokens(text, tokens, max_tokens, overlap)))
+        for (filename, text), tokens in zip(batch, encoded)
+    ]
+
+def _batches(pages, size):
+    batch = []
+    for page in pages:
+        batch.append(page)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# Function to map preprocess_batch over the pages in `processes` worker processes. Results come
+# back in input order, and at most two batches per worker are queued at a time so memory stays
+# bounded however large the corpus is. Workers are spawned rather than forked, so they inherit
+# none of the caller's threads, open connections or event loop
+def _map_batches(batches, processes, args):
+    if processes <= 1:
+        for batch in batches:
+            yield preprocess_batch(batch, *args)
+        return
+    with multiprocessing.get_context("spawn").Pool(processes, initializer=token_byte_lengths) as pool:
+        results = deque()
+        for batch in batches:
+            results.append(pool.apply_async(preprocess_batch, (batch, *args)))
+            if len(results) >= 2 * processes:
+                yield results.popleft().get()
+        while results:
+            yield results.popleft().get()
+
+# Function to fingerprint, encode and chunk a stream of (filename, text) pages across
+# `processes` worker processes (one for fewer than POOL_MIN_PAGES pages) and yield (filename, chunk text, n_tokens) in page order.
+# Near-duplicates (within `dedup_distance` SimHash bits; None disables this) are dropped in
+# the parent in page order, so the output is identical for any number of processes. `known`
+# maps pages indexed by earlier runs to their fingerprint: a page near one of those is dropped
+# too, and a known page that comes again is compared by its new text. The fingerprint of every
+# page is recorded in `fingerprints` and every dropped page in `duplicate_of`, mapped to the
+# page it duplicates, or to None when that was an earlier version of a page that came again
+def preprocess_pages(pages, dedup_distance=MAX_DISTANCE, max_tokens=MAX_TOKENS, overlap=CHUNK_OVERLAP,
+                     processes=PROCESSES, pages_per_task=PAGES_PER_TASK, known=None, fingerprints=None,
+                     duplicate_of=None):
+    if not 0 <= overlap < max_tokens:
+        raise ValueError(f"overlap must be between 0 and max_tokens - 1, got {overlap}")
+    if processes > 1:
+        pages = iter(pages)
+        head = list(islice(pages, POOL_MIN_PAGES))
+        if len(head) < POOL_MIN_PAGES:
+            processes = 1
+        pages = chain(head, pages)
+    duplicates = NearDuplicateIndex(dedup_distance) if dedup_distance is not None else None
+    fingerprints = {} if fingerprints is None else fingerprints
+    duplicate_of = {} if duplicate_of is None else duplicate_of
+    # Pages dropped as near-duplicates of each known page not seen again yet
+    dropped_against = {}
+    if duplicates is not None:
+        for filename, fingerprint in (known or {}).items():
+            duplicates.add(filename, None, fingerprint)
+            dropped_against[filename] = []
+    args = (max_tokens, overlap, duplicates.shingle_size if duplicates is not None else None)
+    n_pages = n_duplicates = tokens_saved = 0
+    for results in _map_batches(_batches(pages, pages_per_task), processes, args):
+        for filename, fingerprint, n_tokens, chunks in results:
+            n_pages += 1
+            fingerprints[filename] = fingerprint
+            if filename in dropped_against:
+                duplicates.remove(filename)
+                for dropped in dropped_against.pop(filename):
+                    duplicate_of[dropped] = None
+            twin = duplicates.add(filename, None, fingerprint) if duplicates is not None else None
+            if twin is not None:
+                duplicate_of[filename] = twin
+                dropped_against.get(twin, []).append(filename)
+                n_duplicates += 1
+                tokens_saved += n_tokens
+                continue
+            for chunk, n_chunk_tokens in chunks:
+                yield filename, chunk, n_chunk_tokens
+    if duplicates is not None:
+        print(f"Dropped {n_duplicates} of {n_pages} pages as near-duplicates ({tokens_saved} tokens saved).")
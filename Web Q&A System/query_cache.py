@@ -0,0 +1,149 @@
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from embedding_cache import EmbeddingCache
+
+# Default size and lifetime of the in-process query embedding cache, and location and size cap
+# of its optional on-disk tier
+QUERY_CACHE_SIZE = 4096
+QUERY_CACHE_TTL = 24 * 60 * 60
+QUERY_CACHE_PATH = "processed/query_cache.db"
+QUERY_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# The on-disk tier is trimmed back to its size cap after this many new entries
+EVICT_EVERY = 1000
+
+# Function to normalize a question so that trivially different spellings share an entry
+def normalize_question(question):
+    return " ".join(question.casefold().split())
+
+# Cache of question embeddings, keyed by (model, dimensions, normalized question). Recent entries
+# are kept in memory and dropped when least recently used; with `persistent`, an EmbeddingCache,
+# misses are looked up on disk before calling the API, so frequent questions survive restarts.
+# In both tiers an embedding expires `ttl` seconds after it was fetched from the API. Safe to
+# share between request threads
+class QueryEmbeddingCache:
+    def __init__(self, max_entries=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL, persistent=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persistent = persistent
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.persistent_lock = threading.Lock()
+        self.persistent_writes = 0
+        self.hits = self.persistent_hits = self.misses = self.expired = self.evicted = 0
+
+    # Function to return the embedding of `question`, calling `embed(question, model, dimensions)`
+    # only when neither tier has it
+    def embedding(self, question, model, dimensions, embed):
+        vector = self.get(question, model, dimensions)
+        if vector is None:
+            vector = self.put(question, model, dimensions, embed(question, model, dimensions))
+        return vector
+
+    # Function to return the cached embedding of `question`, or None (counted as a miss)
+    def get(self, question, model, dimensions):
+        vector = self.get_memory(question, model, dimensions)
+        return vector if vector is not None else self.get_persistent(question, model, dimensions)
+
+    # Function to look `question` up in memory only. Never blocks on I/O; a None result is not
+    # counted until get_persistent has looked on disk too
+    def get_memory(self, question, model, dimensions):
+        key = (model, dimensions, normalize_question(question))
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self.entries[key]
+                self.expired += 1
+        return None
+
+    # Function to look up a question missed by get_memory on disk, or None (counted as a miss)
+    def get_persistent(self, question, model, dimensions):
+        text = normalize_question(question)
+        vector, created = self._persistent_get(f"{model}:{dimensions}", text)
+        if vector is not None:
+            self._remember((model, dimensions, text), vector, self.ttl - (time.time() - created))
+        return vector
+
+    # Function to add the embedding of a question missed by `get` to both tiers; returns it
+    def put(self, question, model, dimensions, embedding):
+        vector = self.remember(question, model, dimensions, embedding)
+        self.persist(question, model, dimensions, vector)
+        return vector
+
+    # Function to add an embedding to the memory tier only; returns it
+    def remember(self, question, model, dimensions, embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        self._remember((model, dimensions, normalize_question(question)), vector)
+        return vector
+
+    # Function to add an embedding to the disk tier only, if there is one
+    def persist(self, question, model, dimensions, vector):
+        self._persistent_put(f"{model}:{dimensions}", normalize_question(question), vector)
+
+    def _remember(self, key, vector, ttl=None):
+        with self.lock:
+            self.entries[key] = (vector, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evicted += 1
+
+    # Reads do not mark disk entries as used: the disk tier evicts the oldest entries first, and
+    # the memory tier keeps the frequent ones
+    def _persistent_get(self, model, text):
+        vector, created = None, []
+        if self.persistent is not None:
+            with self.persistent_lock:
+                vector = self.persistent.get_many(model, [text], self.ttl, touch=False, created=created)[0]
+        with self.lock:
+            if vector is None:
+                self.misses += 1
+            else:
+                self.persistent_hits += 1
+        return vector, created[0] if vector is not None else None
+
+    def _persistent_put(self, model, text, vector):
+        if self.persistent is None:
+            return
+        with self.persistent_lock:
+            self.persistent.put_many(model, [text], [vector])
+            self.persistent_writes += 1
+            if self.persistent_writes % EVICT_EVERY == 0:
+                self.persistent.evict()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.persistent_hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "persistent_hits": self.persistent_hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "evicted": self.evicted,
+                "hit_rate": (self.hits + self.persistent_hits) / total if total else 0.0,
+            }
+
+    def summary(self):
+        stats = self.stats()
+        return (f"Query embedding cache: {stats['hits']} memory hits, {stats['persistent_hits']} disk hits, "
+                f"{stats['misses']} misses ({stats['hit_rate'] * 100:.1f}% hit rate), "
+                f"{stats['expired']} expired, {stats['evicted']} evicted")
+
+    def close(self):
+        if self.persistent is not None:
+            with self.persistent_lock:
+                self.persistent.close()
+
+# Function to create the query cache used by the apps, with its on-disk tier at `path` (None
+# keeps it in memory only)
+def open_query_cache(path=QUERY_CACHE_PATH, max_entries=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL,
+                     max_bytes=QUERY_CACHE_MAX_BYTES):
+    persistent = EmbeddingCache(path, max_bytes) if path is not None else None
+    return QueryEmbeddingCache(max_entries, ttl, persistent)
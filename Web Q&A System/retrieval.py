@@ -0,0 +1,212 @@
+import os
+import threading
+import time
+import numpy as np
+from ann import N_PROBE
+from index_store import INDEX_DIR, LEGACY_CSV, MANIFEST, load_index
+
+# Distance metrics supported by create_context
+DISTANCE_METRICS = ("cosine", "L1", "L2", "Linf")
+
+# Tokens counted for the separator between two context sections
+SEPARATOR_TOKENS = 4
+
+# Seconds between checks of the index manifest for a newer version
+CHECK_INTERVAL = 2.0
+
+# Rows expanded to float32 at a time for metrics that need every coordinate (L1, Linf) and for
+# int8 matrices
+BLOCK_ROWS = 1024
+
+# Function to compute the distance between one query and every row of a matrix, vectorized
+# over the rows
+def distances_from_embeddings(query_embedding, embeddings, distance_metric="cosine"):
+    query = np.asarray(query_embedding, dtype=np.float32)
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if distance_metric == "cosine":
+        norms = np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query)
+        norms[norms == 0] = 1
+        return 1 - embeddings @ query / norms
+    if distance_metric == "L1":
+        return np.abs(embeddings - query).sum(axis=1)
+    if distance_metric == "L2":
+        return np.linalg.norm(embeddings - query, axis=1)
+    if distance_metric == "Linf":
+        return np.abs(embeddings - query).max(axis=1)
+    raise ValueError(f"Unknown distance metric '{distance_metric}'; expected one of {', '.join(DISTANCE_METRICS)}")
+
+# Function to return the positions of the `k` smallest distances, nearest first. Only the
+# selected candidates are sorted, not the whole array
+def nearest(distances, k):
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(distances):
+        candidates = np.argpartition(distances, k - 1)[:k]
+        return candidates[np.argsort(distances[candidates], kind="stable")]
+    return np.argsort(distances, kind="stable")
+
+# In-memory search structure over a loaded index. Rows are kept as one contiguous matrix of
+# unit vectors plus their norms, so cosine distance is a single matrix-vector product and L2
+# follows from the same product; L1 and Linf rebuild the original rows block by block. An int8
+# index stays int8 and memory-mapped (segment by segment when it has several), with one factor
+# per row that turns it into a unit vector. With inverted lists, rows are stored list by list,
+# so every list is a contiguous slice. Texts and token counts are copied out of `meta` once, so
+# queries never read or write the frame
+class SearchIndex:
+    def __init__(self, stored):
+        self.meta = stored.meta
+        self.texts = stored.meta['text'].to_numpy()
+        self.n_tokens = stored.meta['n_tokens'].to_numpy(dtype=np.int64)
+        # Fewest tokens any context section can cost
+        self.min_cost = (int(self.n_tokens.min()) if len(self.n_tokens) else 0) + SEPARATOR_TOKENS
+        self.version = stored.version
+        self.model = stored.model
+        self.dimensions = stored.dimensions
+        self.ann = stored.ann
+        # Position in `meta` of every row of the matrix; None when rows are in `meta` order
+        self.order = stored.ann.order if stored.ann is not None else None
+
+        vectors = stored.vectors if self.order is None else stored.vectors[self.order]
+        scales = stored.scales if self.order is None or stored.scales is None else stored.scales[self.order]
+        lengths = np.empty(len(vectors), dtype=np.float32)
+        for start in range(0, len(vectors), BLOCK_ROWS):
+            lengths[start:start + BLOCK_ROWS] = np.linalg.norm(
+                np.asarray(vectors[start:start + BLOCK_ROWS], dtype=np.float32), axis=1)
+        safe_lengths = np.where(lengths == 0, 1, lengths)
+
+        if scales is None:
+            self.matrix = np.empty(vectors.shape, dtype=np.float32)
+            for start in range(0, len(vectors), BLOCK_ROWS):
+                self.matrix[start:start + BLOCK_ROWS] = (vectors[start:start + BLOCK_ROWS]
+                                                         / safe_lengths[start:start + BLOCK_ROWS, None])
+            self.unit_scales = None
+            self.norms = lengths
+        else:
+            self.matrix = vectors
+            self.unit_scales = (1 / safe_lengths).astype(np.float32)
+            self.norms = (lengths * scales).astype(np.float32)
+
+    def __len__(self):
+        return len(self.matrix)
+
+    # Function to return the dot product of every unit row in [start, stop) with `query`
+    def _unit_dots(self, query, start, stop):
+        if self.unit_scales is None:
+            return self.matrix[start:stop] @ query
+        dots = np.empty(stop - start, dtype=np.float32)
+        for offset in range(start, stop, BLOCK_ROWS):
+            end = min(offset + BLOCK_ROWS, stop)
+            dots[offset - start:end - start] = self.matrix[offset:end].astype(np.float32) @ query
+        return dots * self.unit_scales[start:stop]
+
+    # Function to yield (offset, rows) blocks of the original, unnormalized rows in [start, stop);
+    # blocks are small enough to stay in the CPU cache while they are worked on
+    def _blocks(self, start, stop):
+        factors = self.norms if self.unit_scales is None else self.norms * self.unit_scales
+        for offset in range(start, stop, BLOCK_ROWS):
+            end = min(offset + BLOCK_ROWS, stop)
+            yield offset - start, self.matrix[offset:end] * factors[offset:end, None]
+
+    # Function to return the distances from `query_embedding` to the rows in [start, stop)
+    def _distances(self, query_embedding, distance_metric, start, stop):
+        query = np.asarray(query_embedding, dtype=np.float32)
+        if distance_metric == "cosine":
+            query_norm = np.linalg.norm(query)
+            return 1 - self._unit_dots(query / (query_norm or 1), start, stop)
+        if distance_metric == "L2":
+            norms = self.norms[start:stop]
+            squared = norms ** 2 + query @ query - 2 * norms * self._unit_dots(query, start, stop)
+            return np.sqrt(np.maximum(squared, 0))
+        if distance_metric in ("L1", "Linf"):
+            distances = np.empty(stop - start, dtype=np.float32)
+            for offset, block in self._blocks(start, stop):
+                differences = np.abs(np.subtract(block, query, out=block), out=block)
+                distances[offset:offset + len(block)] = (differences.sum(axis=1) if distance_metric == "L1"
+                                                         else differences.max(axis=1))
+            return distances
+        raise ValueError(f"Unknown distance metric '{distance_metric}'; expected one of {', '.join(DISTANCE_METRICS)}")
+
+    # Function to return the distance from `query_embedding` to every row, in `meta` order
+    def distances(self, query_embedding, distance_metric="cosine"):
+        distances = self._distances(query_embedding, distance_metric, 0, len(self.matrix))
+        if self.order is None:
+            return distances
+        in_meta_order = np.empty_like(distances)
+        in_meta_order[self.order] = distances
+        return in_meta_order
+
+    # Function to return the `meta` positions of the candidate rows for a query and their
+    # distances. With inverted lists and cosine distance, only the `n_probe` lists closest to
+    # the query are scanned; otherwise (small index, other metric) every row is
+    def search(self, query_embedding, distance_metric="cosine", n_probe=N_PROBE):
+        if self.ann is None or distance_metric != "cosine" or n_probe >= len(self.ann.centroids):
+            return np.arange(len(self.matrix)), self.distances(query_embedding, distance_metric)
+        query = np.asarray(query_embedding, dtype=np.float32)
+        probed = np.argpartition(-(self.ann.centroids @ query), n_probe)[:n_probe]
+        ranges = [(self.ann.offsets[i], self.ann.offsets[i + 1]) for i in np.sort(probed)]
+        positions = np.concatenate([np.arange(start, stop) for start, stop in ranges])
+        distances = np.concatenate([self._distances(query, distance_metric, start, stop) for start, stop in ranges])
+        return self.order[positions], distances
+
+    # Function to return the texts of the rows nearest to `query_embedding` that fit in `max_len`
+    # tokens, nearest first, counting each section's tokens plus the separator. At most
+    # max_len // min_cost sections can fit, so only that many candidates are selected and sorted
+    def context(self, query_embedding, max_len, distance_metric="cosine", n_probe=N_PROBE):
+        rows, distances = self.search(query_embedding, distance_metric, n_probe)
+        best = rows[nearest(distances, max_len // self.min_cost)]
+        fits = np.searchsorted(np.cumsum(self.n_tokens[best] + SEPARATOR_TOKENS), max_len, side="right")
+        return self.texts[best[:fits]].tolist()
+
+# Holds the SearchIndex of a serving process. Requests share one read-only instance; at most
+# every `check_interval` seconds the manifest is checked and, when a new version was written,
+# one request thread loads it while the others keep using the old one, which is then swapped
+# out with a single assignment
+class IndexHolder:
+    def __init__(self, directory=INDEX_DIR, legacy_csv=LEGACY_CSV, check_interval=CHECK_INTERVAL):
+        self.directory = directory
+        self.legacy_csv = legacy_csv
+        self.check_interval = check_interval
+        self.index = None
+        self.manifest_mtime = None
+        self.checked = float("-inf")
+        self.lock = threading.Lock()
+
+    # Function to return the current index (None until one exists), reloading it if it changed.
+    # Until an index is loaded every caller waits for the load; after that the manifest is only
+    # checked every `check_interval` seconds, by one thread while the others keep the old index
+    def get(self):
+        if self.index is None:
+            return self.reload(wait=True)
+        if time.monotonic() - self.checked >= self.check_interval:
+            self.reload(wait=False)
+        return self.index
+
+    # Function to return the loaded index without touching the disk, or None while it still has
+    # to be loaded or its manifest is due for a check, which get() then does
+    def current(self):
+        if self.index is not None and time.monotonic() - self.checked < self.check_interval:
+            return self.index
+        return None
+
+    # Function to load the index if its manifest changed since it was last loaded. With
+    # `wait` False, a reload already running in another thread is not waited for
+    def reload(self, wait=True):
+        if not self.lock.acquire(blocking=wait):
+            return self.index
+        try:
+            self.checked = time.monotonic()
+            path = os.path.join(self.directory, MANIFEST)
+            mtime = os.stat(path).st_mtime_ns if os.path.exists(path) else None
+            if self.index is not None and mtime == self.manifest_mtime:
+                return self.index
+            try:
+                stored = load_index(self.directory, self.legacy_csv)
+            except FileNotFoundError:
+                # A writer swapped the manifest and removed the old files while they were read
+                return self.index
+            if stored is not None and (self.index is None or stored.version != self.index.version):
+                self.index = SearchIndex(stored)
+            self.manifest_mtime = mtime
+            return self.index
+        finally:
+            self.lock.release()
@@ -0,0 +1,90 @@
+import glob
+import gzip
+import json
+import os
+import zlib
+
+# Default location and rotation limits of the scraped page shards
+SHARD_DIR = "processed/scraped"
+SHARD_MAX_RECORDS = 1000
+SHARD_MAX_BYTES = 64 * 1024 * 1024
+
+def shard_paths(directory=SHARD_DIR):
+    return sorted(glob.glob(os.path.join(directory, "part-*.jsonl.gz")))
+
+# Append-only writer of gzip-compressed JSONL shards that rotates to a new shard after
+# `max_records` records or `max_bytes` uncompressed bytes. Every flush() ends the current
+# gzip member, so the returned (shard, size) position is a clean point to resume from
+class ShardWriter:
+    def __init__(self, directory=SHARD_DIR, max_records=SHARD_MAX_RECORDS, max_bytes=SHARD_MAX_BYTES, position=None):
+        self.directory = directory
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.file = None
+        self.records = 0
+        self.bytes = 0
+        if position is None:
+            for path in shard_paths(directory):
+                os.remove(path)
+            self.index = 0
+        else:
+            self._truncate(position)
+
+    # Function to drop everything written after a checkpointed position
+    def _truncate(self, position):
+        index, size = position
+        for path in shard_paths(self.directory):
+            if int(os.path.basename(path)[5:10]) > index:
+                os.remove(path)
+        path = self._path(index)
+        if os.path.exists(path):
+            with open(path, "r+b") as f:
+                f.truncate(size)
+            for record in read_shard(path):
+                self.records += 1
+                self.bytes += len(json.dumps(record, ensure_ascii=False)) + 1
+        self.index = index
+
+    def _path(self, index):
+        return os.path.join(self.directory, f"part-{index:05d}.jsonl.gz")
+
+    def write(self, record):
+        if self.records >= self.max_records or self.bytes >= self.max_bytes:
+            self.flush()
+            self.index += 1
+            self.records = 0
+            self.bytes = 0
+        if self.file is None:
+            self.file = gzip.open(self._path(self.index), "at", encoding="utf-8")
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        self.file.write(line)
+        self.records += 1
+        self.bytes += len(line)
+
+    def flush(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        path = self._path(self.index)
+        return self.index, os.path.getsize(path) if os.path.exists(path) else 0
+
+    def close(self):
+        return self.flush()
+
+# Function to lazily read the records of one shard, stopping quietly at a tail that was
+# cut short by a crash
+def read_shard(path):
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    return
+                yield json.loads(line)
+    except (EOFError, zlib.error, gzip.BadGzipFile):
+        return
+
+# Function to lazily read the records of every shard in write order
+def iter_records(directory=SHARD_DIR):
+    for path in shard_paths(directory):
+        yield from read_shard(path)